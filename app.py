@@ -1,55 +1,369 @@
+import time
+_BOOT_T0 = time.perf_counter()
+
 import asyncio
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+import hmac
+import importlib
+import json
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Literal, Optional
+from fastapi import FastAPI, Request, Header, HTTPException, Depends, Query
+from pydantic import BaseModel, Field
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
 from config import require_env_ok, settings
-from database import Database
-from userbot_manager import UserbotManager
-from bot import run_service_bot
+from database import Database, now_ts
 
 require_env_ok()
 
 app = FastAPI(title="Userbot SaaS")
 
-templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = None  # Jinja প্রথম "/" রিকুয়েস্টে লোড হয়
 
 db = Database()
-userbots = UserbotManager(db=db)
+# pyrogram ভারী, তাই userbot_manager/bot মডিউল module import এ নয়, ব্যাকগ্রাউন্ড স্টার্টআপে (socket খোলার পরে) import হয়
+userbots = None
 bot_instance = None
+_boot_task: Optional[asyncio.Task] = None
+
+
+class StartupTimer:
+    """স্টার্টআপের প্রতিটা ধাপ কত ms নিল; /readyz আর startup log এ দেখা যায়"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.db_ready = False
+        self.ready = False
+        self.error = ""
+
+    @asynccontextmanager
+    async def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - t) * 1000, 1)
+
+
+timer = StartupTimer()
+timer.phases["module_import"] = round((time.perf_counter() - _BOOT_T0) * 1000, 1)
+
+
+async def _build_indexes():
+    async with timer.phase("indexes"):
+        try:
+            await db.ensure_indexes()
+        except Exception as e:
+            await db.add_log(0, "ERROR", f"Index creation failed: {e}")
+
+
+async def _reencode_rows():
+    try:
+        n = await db.reencode_rows()
+        if n:
+            await db.add_log(0, "INFO", "Rows re-encoded", {"rows": n, "codec": db.codec.name})
+    except Exception as e:
+        await db.add_log(0, "ERROR", f"Row re-encode failed: {e}")
+
+
+async def _db_maintenance():
+    # ব্যাকগ্রাউন্ডে: আগে index, তারপর পুরনো row এর re-encode; রিকোয়েস্ট সার্ভ করা আটকায় না
+    await _build_indexes()
+    if settings.DB_REENCODE:
+        await _reencode_rows()
+
+
+async def _boot():
+    global bot_instance, userbots
+    t0 = time.perf_counter()
+
+    async def _start_db():
+        async with timer.phase("db_connect"):
+            await db.connect()
+        timer.db_ready = True
+
+    async def _start_bot():
+        # pyrogram import এর সময় asyncio.get_event_loop() কল করে (pyrogram/sync.py), তাই
+        # worker thread এ নয়, event loop এর থ্রেডেই import করতে হয়
+        t = time.perf_counter()
+        ub_mod = importlib.import_module("userbot_manager")
+        bot_mod = importlib.import_module("bot")
+        timer.phases["import_runtime"] = round((time.perf_counter() - t) * 1000, 1)
+        bot = bot_mod.ServiceBot(db, ub_mod.UserbotManager(db=db))
+        async with timer.phase("bot_login"):
+            await bot.connect()
+        return bot
+
+    try:
+        # DB connect আর Telegram login একসাথে; _start_db আগে শিডিউল হয়, তাই import এর আগেই connect শুরু হয়ে যায়
+        _, bot = await asyncio.gather(_start_db(), _start_bot())
+        # shutdown এ থামানোর জন্য login এর পরেই রাখা; readiness এর জন্য timer.ready দেখা হয়
+        bot_instance = bot
+        asyncio.create_task(_db_maintenance())
+
+        userbots = bot.userbots
+        async with timer.phase("userbots_start"):
+            await userbots.start()
+        async with timer.phase("bot_start"):
+            await bot.start()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # প্রসেস বেঁচে থাকে (/healthz 200), কিন্তু /readyz 503 সহ error দেখায়
+        timer.error = str(e) or type(e).__name__
+        logging.getLogger(__name__).exception("Startup failed")
+        return
+
+    timer.phases["startup_total"] = round((time.perf_counter() - t0) * 1000, 1)
+    timer.ready = True
+    await db.add_log(0, "INFO", "Web service started", {"startup_ms": timer.phases})
 
 
 @app.on_event("startup")
 async def on_startup():
-    global bot_instance
-    await db.connect()
-    await userbots.start()
-    bot_instance = await run_service_bot(db, userbots)
-    await db.add_log(0, "INFO", "Web service started")
+    # পুরো স্টার্টআপ ব্যাকগ্রাউন্ডে: uvicorn সাথে সাথে socket খোলে, /healthz তখনই 200,
+    # আর /readyz 503 থাকে যতক্ষণ না DB + service bot + userbots চালু হয়
+    global _boot_task
+    _boot_task = asyncio.create_task(_boot())
 
 @app.on_event("shutdown")
 async def on_shutdown():
     global bot_instance
+    if _boot_task and not _boot_task.done():
+        _boot_task.cancel()
+        await asyncio.gather(_boot_task, return_exceptions=True)
     try:
         if bot_instance:
             await bot_instance.stop()
     except Exception:
         pass
     try:
-        await userbots.stop()
+        if userbots:
+            await userbots.stop()
     except Exception:
         pass
-    await db.close()
+    if timer.db_ready:
+        await db.close()
+
+
+@app.get("/healthz")
+async def healthz():
+    # liveness: প্রসেস বেঁচে আছে কিনা, কোনো dependency চেক নয়
+    return JSONResponse({"ok": True})
+
+
+@app.get("/readyz")
+async def readyz():
+    # readiness: DB + service bot চালু হলে তবেই 200
+    return JSONResponse(
+        {"ok": timer.ready, "indexes_ready": db.indexes_ready, "startup_ms": timer.phases,
+         "error": timer.error or None},
+        status_code=200 if timer.ready else 503,
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
+    global templates
+    if templates is None:
+        from fastapi.templating import Jinja2Templates
+        templates = Jinja2Templates(directory="templates")
     return templates.TemplateResponse("index.html", {"request": request, "base": settings.PUBLIC_BASE_URL})
 
 
-@app.get("/api/logs")
+async def require_admin(x_admin_token: str = Header(default="")):
+    if not settings.ADMIN_API_TOKEN or not hmac.compare_digest(x_admin_token, settings.ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+
+async def require_db():
+    # স্টার্টআপ ব্যাকগ্রাউন্ডে চলে; DB connect এর আগে আসা রিকোয়েস্ট 503
+    if not timer.db_ready:
+        raise HTTPException(status_code=503, detail="starting")
+
+
+@app.get("/api/logs", dependencies=[Depends(require_db)])
 async def api_logs(limit: int = 200):
+    """
+    history + `last_id`: ড্যাশবোর্ড stream এ `last_id` দিলে এর পরের লগ ring থেকে আসে, মাঝে ফাঁক থাকে না।
+    query চলাকালীন নতুন লগগুলো stream এ আসবে, তাই history থেকে বাদ (দুবার না দেখাতে)।
+    """
+    last_id = db.log_hub.last_id
     logs = await db.list_logs(limit=limit)
-    return JSONResponse({"ok": True, "logs": logs})
+    newer = Counter(_log_key(e) for e in db.log_hub.since(last_id))
+    if newer:
+        kept = []
+        for e in logs:
+            if newer[_log_key(e)] > 0:
+                newer[_log_key(e)] -= 1
+            else:
+                kept.append(e)
+        logs = kept
+    return JSONResponse({"ok": True, "logs": logs, "last_id": last_id})
+
+
+def _log_key(e: Dict[str, Any]):
+    return e["ts"], e["user_id"], e["level"], e["message"]
+
+
+@app.get("/api/stats", dependencies=[Depends(require_admin), Depends(require_db)])
+async def api_stats(user_id: Optional[int] = None, hours: int = 24):
+    """
+    Per-chat activity: `live` = মেমোরির ring (শেষ STATS_BUCKETS মিনিট),
+    `totals` = chat_stats aggregate টেবিল (শেষ `hours` ঘণ্টা)। logs টেবিল স্ক্যান হয় না।
+    সব ইউজারের chat id থাকে, তাই শুধু admin token দিয়ে।
+    """
+    if not userbots:
+        return JSONResponse({"ok": False, "error": "starting"}, status_code=503)
+    hours = max(1, min(24 * 90, int(hours)))
+    totals = await db.get_chat_stats(now_ts() - hours * 3600, user_id)
+    return JSONResponse({
+        "ok": True,
+        "window_seconds": settings.STATS_BUCKETS * settings.STATS_BUCKET_SECONDS,
+        "live": userbots.stats.live(user_id),
+        "hours": hours,
+        "totals": totals,
+    })
+
+
+@app.get("/api/logs/stream")
+async def api_logs_stream(request: Request, user_id: Optional[int] = None, level: str = "",
+                          last_id: Optional[int] = None, last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-Sent Events: add_log থেকে সরাসরি লাইভ লগ। `level=INFO,ERROR` আর `user_id` দিয়ে ফিল্টার,
+    `last_id` (বা EventSource এর Last-Event-ID) দিয়ে in-memory ring থেকে resume।
+    """
+    if last_id is None and last_event_id and last_event_id.isdigit():
+        last_id = int(last_event_id)
+    levels = {x.strip().upper() for x in level.split(",") if x.strip()} or None
+    sub = db.log_hub.subscribe(user_id=user_id, levels=levels, last_id=last_id)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if sub.evicted and sub.queue.empty():
+                    # slow consumer: বন্ধ করে দিই, ব্রাউজার Last-Event-ID দিয়ে আবার কানেক্ট করবে
+                    yield "event: evicted\ndata: {}\n\n"
+                    return
+                try:
+                    entry = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {entry['id']}\ndata: {json.dumps(entry, ensure_ascii=False)}\n\n"
+        finally:
+            db.log_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------------- Admin API ----------------
+@app.get("/api/admin/clients", dependencies=[Depends(require_admin)])
+async def api_admin_clients():
+    if not userbots:
+        return JSONResponse({"ok": False, "error": "starting"}, status_code=503)
+    clients = userbots.health_snapshot()
+    counts = {}
+    for c in clients:
+        counts[c["state"]] = counts.get(c["state"], 0) + 1
+    return JSONResponse({"ok": True, "counts": counts, "clients": clients})
+
+
+@app.get("/api/admin/metrics", dependencies=[Depends(require_admin)])
+async def api_admin_metrics():
+    if not bot_instance:
+        return JSONResponse({"ok": False, "error": "bot not started"}, status_code=503)
+    return JSONResponse({
+        "ok": True,
+        "rate_limit": bot_instance.rate_metrics,
+        "admission_waiting": bot_instance.admission.waiting,
+        "admission_running": bot_instance.admission.running,
+        "reconcile": bot_instance.userbots.reconcile_metrics,
+        "log_stream": {"subscribers": len(db.log_hub.subscribers), "evictions": db.log_hub.evictions},
+    })
+
+
+# ---------------- Bulk admin API ----------------
+MAX_BATCH = 5000
+
+
+class PremiumExtendBody(BaseModel):
+    user_ids: List[int] = Field(...)
+    days: int = Field(0, ge=0)
+    seconds: int = Field(0, ge=0)
+
+
+class ConfigItem(BaseModel):
+    user_id: int
+    allow_chats: Optional[List[int]] = None
+    templates: Optional[List[Dict[str, Any]]] = None
+
+
+class ConfigImportBody(BaseModel):
+    configs: List[ConfigItem] = Field(...)
+    # replace: দেওয়া ফিল্ড বদলে দেয়; merge: allow_chats union, templates শেষে যোগ
+    mode: Literal["replace", "merge"] = "replace"
+
+
+class UserIdsBody(BaseModel):
+    user_ids: List[int] = Field(...)
+
+
+def _check_batch(items: list):
+    if not items:
+        raise HTTPException(status_code=400, detail="empty batch")
+    if len(items) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"batch too large (max {MAX_BATCH})")
+
+
+@app.post("/api/admin/premium/extend", dependencies=[Depends(require_admin), Depends(require_db)])
+async def api_admin_premium_extend(body: PremiumExtendBody):
+    _check_batch(body.user_ids)
+    seconds = body.days * 86400 + body.seconds
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="days or seconds required")
+    user_ids = sorted(set(body.user_ids))
+    until = await db.extend_premium_bulk(user_ids, seconds)
+    if userbots:
+        await userbots.apply_bulk_changes(premium_users=user_ids)
+    await db.add_log(0, "INFO", "Bulk premium extended", {"count": len(user_ids), "seconds": seconds})
+    return JSONResponse({"ok": True, "premium_until": {str(k): v for k, v in until.items()}})
+
+
+@app.get("/api/admin/configs/export", dependencies=[Depends(require_admin), Depends(require_db)])
+async def api_admin_configs_export(user_ids: Optional[List[int]] = Query(None)):
+    if user_ids:
+        _check_batch(user_ids)
+    return JSONResponse({"ok": True, "configs": await db.export_configs(user_ids or None)})
+
+
+@app.post("/api/admin/configs/import", dependencies=[Depends(require_admin), Depends(require_db)])
+async def api_admin_configs_import(body: ConfigImportBody):
+    _check_batch(body.configs)
+    # একই user_id দুবার থাকলে শেষেরটা; merge/আংশিক আপডেট backend এক bulk write এ করে
+    items = {c.user_id: c for c in body.configs}
+    rows = [{"user_id": uid, "allow_chats": c.allow_chats, "templates": c.templates} for uid, c in items.items()]
+    await db.import_configs(rows, body.mode)
+    if userbots:
+        await userbots.apply_bulk_changes(config_users=list(items))
+    await db.add_log(0, "INFO", "Bulk config import", {"count": len(rows), "mode": body.mode})
+    return JSONResponse({"ok": True, "imported": len(rows)})
+
+
+@app.post("/api/admin/sessions/revoke", dependencies=[Depends(require_admin), Depends(require_db)])
+async def api_admin_sessions_revoke(body: UserIdsBody):
+    _check_batch(body.user_ids)
+    user_ids = sorted(set(body.user_ids))
+    revoked = await db.revoke_sessions(user_ids)
+    if userbots:
+        await userbots.apply_bulk_changes(revoked_users=user_ids)
+    await db.add_log(0, "INFO", "Bulk sessions revoked", {"count": revoked})
+    return JSONResponse({"ok": True, "revoked": revoked})
@@ -0,0 +1,433 @@
+"""
+Database backend conformance + micro-benchmark.
+
+    # দুই backend এ একই অপারেশন চালিয়ে ফলাফল মিলানো
+    python bench_db.py conformance [--mongo-uri mongodb://localhost/bench_db]
+
+    # ops/sec আর latency percentile, ফলাফল JSON এ
+    python bench_db.py bench --backend sqlite --users 200000 --logs 1000000 --out bench.json
+
+    # SQLite JSON কলামের codec: পুরনো row বনাম json / zjson, ফাইল সাইজ আর decode খরচ
+    python bench_db.py codec --users 50000 --logs 200000 --out codec.json
+
+Mongo: --mongo-uri দিলে সেই সার্ভার (database নামে "bench" বা "test" থাকতে হবে, শেষে drop হয়),
+না দিলে mongomock-motor ইনস্টল থাকলে in-process stand-in ব্যবহার হয়
+(conformance এর জন্য ঠিক আছে, কিন্তু এর latency আসল MongoDB এর মতো নয়)।
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from codec import RowCodec
+from database import Database, now_ts
+
+
+# ---------------- Backends ----------------
+async def open_backend(name: str, mongo_uri: str = "") -> Tuple[Database, Callable]:
+    if name == "sqlite":
+        fd, path = tempfile.mkstemp(prefix="bench_", suffix=".db")
+        os.close(fd)
+        db = Database(mongo_uri="", sqlite_path=path)
+
+        async def cleanup():
+            await db.close()
+            os.remove(path)
+    else:
+        if mongo_uri:
+            db = Database(mongo_uri=mongo_uri)
+        else:
+            try:
+                from mongomock_motor import AsyncMongoMockClient
+            except ImportError:
+                raise SystemExit("mongo backend: --mongo-uri দিন অথবা `pip install mongomock-motor`")
+            db = Database(mongo_db=AsyncMongoMockClient()["bench_db"])
+
+        async def cleanup():
+            await db._mongo.drop_database(db._db.name)
+            await db.close()
+
+    if db.mode != name:
+        raise SystemExit(f"{name} backend চালু করা যায়নি (mode={db.mode}); driver ইনস্টল আছে কিনা দেখুন")
+    await db.connect()
+    if db.mode == "mongo" and not any(x in db._db.name for x in ("bench", "test")):
+        await db.close()
+        raise SystemExit(f"refusing to use database '{db._db.name}': নামে 'bench' বা 'test' থাকতে হবে")
+    await db.ensure_indexes()
+    return db, cleanup
+
+
+# ---------------- Conformance ----------------
+NOW = now_ts()
+FUTURE = NOW + 7 * 86400
+TIME_FIELDS = ("ts", "created_at", "updated_at", "lease_until")
+
+
+def _steps() -> List[Tuple[str, Callable[[Database], Any]]]:
+    return [
+        ("upsert_user", lambda db: db.upsert_user(1, "alice")),
+        ("upsert_user_again", lambda db: db.upsert_user(1, "alice2")),
+        ("upsert_user_2", lambda db: db.upsert_user(3, "")),
+        ("get_user", lambda db: db.get_user(1)),
+        ("get_user_missing", lambda db: db.get_user(999)),
+        ("set_premium_unknown_user", lambda db: db.set_premium(2, FUTURE)),
+        ("get_user_premium_only", lambda db: db.get_user(2)),
+        ("is_premium_active", lambda db: db.is_premium_active(2)),
+        ("is_premium_inactive", lambda db: db.is_premium_active(1)),
+        ("set_session", lambda db: db.set_session(1, "s" * 40)),
+        ("set_session_overwrite", lambda db: db.set_session(1, "t" * 40)),
+        ("set_session_2", lambda db: db.set_session(3, "u" * 40)),
+        ("get_session", lambda db: db.get_session(1)),
+        ("get_session_missing", lambda db: db.get_session(2)),
+        ("get_users_with_sessions", lambda db: db.get_users_with_sessions()),
+        ("get_config_default", lambda db: db.get_config(5)),
+        ("set_allow_chats", lambda db: db.set_allow_chats(1, [-1003, -1001])),
+        ("set_templates", lambda db: db.set_templates(1, [{"text": "a"}, {"text": "Image: x.jpg\nবাংলা"}])),
+        ("get_config", lambda db: db.get_config(1)),
+        ("add_log", lambda db: db.add_log(1, "INFO", "one", {"chat_id": -1001})),
+        ("add_log_2", lambda db: db.add_log(1, "ERROR", "two")),
+        ("add_log_3", lambda db: db.add_log(0, "INFO", "তিন", {"nested": {"a": [1, 2]}})),
+        ("list_logs", lambda db: db.list_logs(10)),
+        ("list_logs_clamped", lambda db: db.list_logs(0)),
+        ("add_job_due", lambda db: db.add_job("j1", 1, -1001, 0, NOW - 5)),
+        ("add_job_future", lambda db: db.add_job("j2", 1, -1001, 1, FUTURE)),
+        ("fetch_due_jobs", lambda db: db.fetch_due_jobs(now_ts())),
+        ("mark_job_done", lambda db: db.mark_job_done("j1")),
+        ("fetch_due_jobs_after_done", lambda db: db.fetch_due_jobs(now_ts())),
+        ("iter_user_ids", lambda db: db.iter_user_ids(0, 10)),
+        ("iter_user_ids_after", lambda db: db.iter_user_ids(1, 1)),
+        ("count_active_users", lambda db: db.count_active_users()),
+        ("create_broadcast", lambda db: db.create_broadcast("b1", "hello", 3)),
+        ("get_broadcast", lambda db: db.get_broadcast("b1")),
+        ("claim_broadcast", lambda db: db.claim_broadcast("b1", "inst-a", 60, now=NOW)),
+        ("claim_broadcast_other", lambda db: db.claim_broadcast("b1", "inst-b", 60, now=NOW)),
+        ("claim_broadcast_renew", lambda db: db.claim_broadcast("b1", "inst-a", 60, now=NOW + 30)),
+        ("claim_broadcast_expired", lambda db: db.claim_broadcast("b1", "inst-b", 60, now=NOW + 200)),
+        ("get_broadcast_claimed", lambda db: db.get_broadcast("b1")),
+        ("release_broadcast_not_owner", lambda db: db.release_broadcast("b1", "inst-a")),
+        ("release_broadcast", lambda db: db.release_broadcast("b1", "inst-b")),
+        ("record_broadcast_batch", lambda db: db.record_broadcast_batch("b1", 2, [(1, "sent", None), (2, "failed", "USER_IS_BLOCKED")])),
+        ("get_broadcast_recipients_done", lambda db: db.get_broadcast_recipients_done("b1", [1, 2, 3])),
+        ("get_broadcast_progress", lambda db: db.get_broadcast("b1")),
+        ("list_broadcasts_running", lambda db: db.list_broadcasts(status="running")),
+        ("set_broadcast_status", lambda db: db.set_broadcast_status("b1", "paused")),
+        ("list_broadcasts_running_after", lambda db: db.list_broadcasts(status="running")),
+        ("save_pending_posts", lambda db: db.save_pending_posts([(1, -1001, 1000.5), (1, -1003, 2000.25), (3, -1001, 1500.0)])),
+        ("save_pending_posts_overwrite", lambda db: db.save_pending_posts([(1, -1001, 1100.5)])),
+        ("get_pending_post_users", lambda db: db.get_pending_post_users()),
+        ("pop_pending_posts", lambda db: db.pop_pending_posts(1)),
+        ("pop_pending_posts_again", lambda db: db.pop_pending_posts(1)),
+        ("claim_send", lambda db: db.claim_send("1:-1001:1", 1, -1001)),
+        ("claim_send_duplicate", lambda db: db.claim_send("1:-1001:1", 1, -1001)),
+        ("finish_send", lambda db: db.finish_send("1:-1001:1", "sent")),
+        ("prune_send_ledger", lambda db: db.prune_send_ledger(now_ts() + 10)),
+        ("claim_send_after_prune", lambda db: db.claim_send("1:-1001:1", 1, -1001)),
+        ("add_chat_stats", lambda db: db.add_chat_stats([(1, -1001, 3600, 5, 1, 1, 0), (1, -1003, 3600, 2, 0, 0, 1)])),
+        ("add_chat_stats_increment", lambda db: db.add_chat_stats([(1, -1001, 3600, 1, 0, 1, 0), (3, -1001, 7200, 1, 0, 0, 0)])),
+        ("get_chat_stats_user", lambda db: db.get_chat_stats(0, 1)),
+        ("get_chat_stats_all", lambda db: db.get_chat_stats(3600)),
+        ("extend_premium_bulk", lambda db: db.extend_premium_bulk([1, 2, 7], 86400, now=NOW)),
+        ("get_user_extended_new", lambda db: db.get_user(7)),
+        ("import_configs", lambda db: db.import_configs([{"user_id": 1, "allow_chats": [-1005], "templates": [{"text": "x"}]},
+                                                         {"user_id": 8, "allow_chats": [], "templates": []}])),
+        ("get_config_imported_empty_templates", lambda db: db.get_config(8)),
+        ("import_configs_merge", lambda db: db.import_configs([{"user_id": 1, "allow_chats": [-1001, -1005], "templates": [{"text": "y"}]},
+                                                               {"user_id": 8, "allow_chats": [-1002]},
+                                                               {"user_id": 9, "templates": [{"text": "$z"}]}], "merge")),
+        ("get_configs_merged", lambda db: db.get_configs([1, 8, 9])),
+        ("import_configs_partial", lambda db: db.import_configs([{"user_id": 1, "allow_chats": [-1009, -1009]},
+                                                                 {"user_id": 9, "templates": None}])),
+        ("set_templates_after_import", lambda db: db.set_templates(8, [{"text": "t"}])),
+        ("export_configs", lambda db: db.export_configs()),
+        ("export_configs_subset", lambda db: db.export_configs([8, 9])),
+        ("get_configs", lambda db: db.get_configs([1, 8, 9])),
+        ("revoke_sessions", lambda db: db.revoke_sessions([1, 2])),
+        ("revoke_sessions_again", lambda db: db.revoke_sessions([1, 2])),
+        ("get_session_revoked", lambda db: db.get_session(1)),
+        ("get_users_with_sessions_after_revoke", lambda db: db.get_users_with_sessions()),
+    ]
+
+
+# ফলাফলের ক্রম যেখানে নির্দিষ্ট নয় (একই ts / set semantics)
+UNORDERED = {"get_users_with_sessions", "get_users_with_sessions_after_revoke", "get_pending_post_users", "pop_pending_posts",
+             "get_broadcast_recipients_done"}
+
+
+def _normalize(name: str, value: Any) -> Any:
+    def norm(v, key=None):
+        if isinstance(v, dict):
+            return {k: norm(x, k) for k, x in sorted(v.items())}
+        if key == "allow_chats" and isinstance(v, list):
+            # set semantics: Mongo এর $setUnion ক্রমের নিশ্চয়তা দেয় না
+            return sorted(v)
+        if isinstance(v, (list, tuple)):
+            return [norm(x) for x in v]
+        if key in TIME_FIELDS and isinstance(v, int) and abs(v - now_ts()) < 3600:
+            return "<now>"
+        return v
+
+    out = norm(value)
+    if name in UNORDERED and isinstance(out, list):
+        out = sorted(out, key=lambda x: json.dumps(x, sort_keys=True, ensure_ascii=False))
+    return out
+
+
+async def run_conformance(args) -> int:
+    results: Dict[str, Dict[str, Any]] = {}
+    for backend in ("sqlite", "mongo"):
+        db, cleanup = await open_backend(backend, args.mongo_uri)
+        try:
+            res = {}
+            for name, step in _steps():
+                try:
+                    res[name] = _normalize(name, await step(db))
+                except Exception as e:
+                    res[name] = {"error": f"{type(e).__name__}: {e}"}
+            results[backend] = res
+        finally:
+            await cleanup()
+
+    mismatches = []
+    for name, _ in _steps():
+        a, b = results["sqlite"][name], results["mongo"][name]
+        status = "ok" if a == b else "MISMATCH"
+        print(f"{status:8} {name}")
+        if a != b:
+            mismatches.append({"step": name, "sqlite": a, "mongo": b})
+            print(f"         sqlite: {json.dumps(a, ensure_ascii=False, default=str)}")
+            print(f"         mongo:  {json.dumps(b, ensure_ascii=False, default=str)}")
+
+    if args.out:
+        _write_json(args.out, {"meta": _meta(args), "kind": "conformance",
+                               "steps": len(_steps()), "mismatches": mismatches})
+    print(f"\n{len(_steps()) - len(mismatches)}/{len(_steps())} steps identical")
+    return 1 if mismatches else 0
+
+
+# ---------------- Benchmark ----------------
+async def seed(db: Database, users: int, logs: int, chunk: int = 50000):
+    """বাস্তবসম্মত সাইজের ডেটা সরাসরি bulk insert (API দিয়ে এক এক করে নয়)"""
+    now = now_ts()
+    rng = random.Random(42)
+    cfg_allow = json.dumps([-1001000000000 - i for i in range(5)])
+    cfg_tpl = json.dumps([{"text": "Hello! This is a scheduled update. " * 3}, {"text": "Reminder"}])
+
+    def user_rows(lo, hi):
+        return [(uid, f"user{uid}", now - rng.randint(0, 10**7), now + rng.randint(-10**6, 10**6), 1)
+                for uid in range(lo, hi)]
+
+    def log_rows(n):
+        return [(now - rng.randint(0, 30 * 86400), rng.randint(1, max(1, users)), rng.choice(("INFO", "ERROR")),
+                 "Ads posted in -100123456789", {"chat_id": -100123456789}) for _ in range(n)]
+
+    for lo in range(1, users + 1, chunk):
+        hi = min(users + 1, lo + chunk)
+        rows = user_rows(lo, hi)
+        jobs = [(f"job{uid}", uid, -1001, 0, now + rng.randint(-3600, 3600), rng.choice(("pending", "done")))
+                for uid in range(lo, hi, 10)]
+        if db.mode == "mongo":
+            await db._db.users.insert_many([dict(zip(("user_id", "username", "created_at", "premium_until", "is_active"), r[:4] + (True,))) for r in rows])
+            await db._db.configs.insert_many([{"user_id": r[0], "allow_chats": json.loads(cfg_allow),
+                                               "templates": json.loads(cfg_tpl), "updated_at": now} for r in rows])
+            await db._db.jobs.insert_many([dict(zip(("job_id", "user_id", "chat_id", "template_idx", "run_at", "status"), j)) for j in jobs])
+        else:
+            await db._sqlite.executemany("INSERT INTO users VALUES(?,?,?,?,?)", rows)
+            await db._sqlite.executemany("INSERT INTO configs VALUES(?,?,?,?)", [(r[0], cfg_allow, cfg_tpl, now) for r in rows])
+            await db._sqlite.executemany("INSERT INTO jobs VALUES(?,?,?,?,?,?)", jobs)
+            await db._sqlite.commit()
+
+    done = 0
+    while done < logs:
+        n = min(chunk, logs - done)
+        rows = log_rows(n)
+        if db.mode == "mongo":
+            await db._db.logs.insert_many([dict(zip(("ts", "user_id", "level", "message", "meta"), r)) for r in rows])
+        else:
+            await db._sqlite.executemany("INSERT INTO logs VALUES(?,?,?,?,?)",
+                                         [r[:4] + (json.dumps(r[4]),) for r in rows])
+            await db._sqlite.commit()
+        done += n
+
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+async def measure(name: str, op: Callable[[int], Any], iterations: int, warmup: int) -> Dict[str, Any]:
+    for i in range(warmup):
+        await op(i)
+    lat = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        await op(i)
+        lat.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - started
+    lat.sort()
+    return {
+        "op": name,
+        "n": iterations,
+        "ops_per_sec": round(iterations / total, 1) if total else None,
+        "p50_ms": round(_percentile(lat, 50), 4),
+        "p95_ms": round(_percentile(lat, 95), 4),
+        "p99_ms": round(_percentile(lat, 99), 4),
+        "max_ms": round(lat[-1], 4) if lat else 0.0,
+    }
+
+
+def bench_ops(db: Database, users: int) -> List[Tuple[str, Callable[[int], Any]]]:
+    rng = random.Random(7)
+    uid = lambda: rng.randint(1, max(1, users))
+    return [
+        ("get_config", lambda i: db.get_config(uid())),
+        ("add_log", lambda i: db.add_log(uid(), "INFO", "bench log", {"i": i})),
+        ("upsert_user", lambda i: db.upsert_user(uid(), "bench")),
+        ("list_logs", lambda i: db.list_logs(200)),
+        ("fetch_due_jobs", lambda i: db.fetch_due_jobs(now_ts(), 50)),
+    ]
+
+
+async def run_bench(args) -> int:
+    out = {"meta": _meta(args), "kind": "bench", "results": []}
+    for backend in args.backend:
+        db, cleanup = await open_backend(backend, args.mongo_uri)
+        try:
+            t = time.perf_counter()
+            await seed(db, args.users, args.logs)
+            print(f"[{backend}] seeded {args.users} users / {args.logs} logs in {time.perf_counter() - t:.1f}s")
+            for name, op in bench_ops(db, args.users):
+                if args.ops and name not in args.ops:
+                    continue
+                r = await measure(name, op, args.iterations, args.warmup)
+                r["backend"] = backend
+                out["results"].append(r)
+                print(f"[{backend}] {name:15} {r['ops_per_sec']:>10} ops/s  p50 {r['p50_ms']:.3f}ms  "
+                      f"p95 {r['p95_ms']:.3f}ms  p99 {r['p99_ms']:.3f}ms")
+        finally:
+            await cleanup()
+    if args.out:
+        _write_json(args.out, out)
+    return 0
+
+
+async def _codec_sizes(db: Database) -> Dict[str, int]:
+    await db._sqlite.execute("VACUUM")
+    cur = await db._sqlite.execute(
+        "SELECT (SELECT COALESCE(SUM(length(allow_chats) + length(templates)), 0) FROM configs),"
+        " (SELECT COALESCE(SUM(length(meta)), 0) FROM logs)"
+    )
+    cfg_bytes, meta_bytes = await cur.fetchone()
+    return {"file_bytes": os.path.getsize(db.sqlite_path), "config_bytes": cfg_bytes, "log_meta_bytes": meta_bytes}
+
+
+async def _decode_cost(db: Database) -> Dict[str, float]:
+    """শুধু decode এর CPU খরচ (I/O বাদ): সব row একবার পড়ে মেমোরিতে, তারপর decode"""
+    out = {}
+    for name, sql in (("config", "SELECT allow_chats, templates FROM configs"), ("log_meta", "SELECT meta FROM logs")):
+        rows = await (await db._sqlite.execute(sql)).fetchall()
+        t = time.perf_counter()
+        for r in rows:
+            for v in r:
+                db.codec.decode(v)
+        out[f"{name}_decode_us"] = round((time.perf_counter() - t) * 1e6 / max(1, len(rows)), 3)
+    return out
+
+
+async def run_codec(args) -> int:
+    """
+    seed() পুরনো ফরম্যাটে (json.dumps text) লেখে। তারপর প্রতিটা codec এ reencode_rows চালিয়ে
+    সাইজ, per-row decode খরচ আর get_config / list_logs latency তুলনা।
+    """
+    out = {"meta": _meta(args), "kind": "codec", "results": []}
+    db, cleanup = await open_backend("sqlite")
+    try:
+        await seed(db, args.users, args.logs)
+        db.codec = RowCodec("json")
+        for label in ("legacy",) + tuple(args.codecs):
+            t = time.perf_counter()
+            rewritten = 0
+            if label != "legacy":
+                db.codec = RowCodec(label)
+                rewritten = await db.reencode_rows(batch=5000, pause=0)
+            r = {"codec": label, "rewritten": rewritten, "reencode_s": round(time.perf_counter() - t, 2)}
+            r.update(await _codec_sizes(db))
+            r.update(await _decode_cost(db))
+            for name, op in bench_ops(db, args.users):
+                if name in ("get_config", "list_logs"):
+                    m = await measure(name, op, args.iterations, args.warmup)
+                    r[f"{name}_p50_ms"] = m["p50_ms"]
+                    r[f"{name}_p99_ms"] = m["p99_ms"]
+            out["results"].append(r)
+            print(f"[{label:6}] file {r['file_bytes'] / 1e6:8.2f}MB  config {r['config_bytes'] / 1e6:7.2f}MB  "
+                  f"meta {r['log_meta_bytes'] / 1e6:7.2f}MB  decode cfg {r['config_decode_us']:.2f}us "
+                  f"meta {r['log_meta_decode_us']:.2f}us  get_config p50 {r['get_config_p50_ms']:.3f}ms  "
+                  f"list_logs p50 {r['list_logs_p50_ms']:.3f}ms")
+    finally:
+        await cleanup()
+    if args.out:
+        _write_json(args.out, out)
+    return 0
+
+
+# ---------------- Output ----------------
+def _meta(args) -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        rev = ""
+    meta = {k: v for k, v in vars(args).items() if k not in ("func", "mongo_uri")}
+    meta.update({"ts": now_ts(), "git_rev": rev, "python": platform.python_version(), "platform": platform.platform()})
+    return meta
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    print(f"wrote {path}")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    c = sub.add_parser("conformance", help="SQLite আর Mongo backend এর ফলাফল মিলানো")
+    c.add_argument("--mongo-uri", default="")
+    c.add_argument("--out", default="")
+    c.set_defaults(func=run_conformance)
+
+    b = sub.add_parser("bench", help="ops/sec + latency percentile")
+    b.add_argument("--backend", nargs="+", choices=("sqlite", "mongo"), default=["sqlite"])
+    b.add_argument("--mongo-uri", default="")
+    b.add_argument("--users", type=int, default=200000)
+    b.add_argument("--logs", type=int, default=1000000)
+    b.add_argument("--iterations", type=int, default=2000)
+    b.add_argument("--warmup", type=int, default=100)
+    b.add_argument("--ops", nargs="*", default=[])
+    b.add_argument("--out", default="bench_results.json")
+    b.set_defaults(func=run_bench)
+
+    k = sub.add_parser("codec", help="SQLite JSON কলামের codec: সাইজ + decode খরচ")
+    k.add_argument("--users", type=int, default=50000)
+    k.add_argument("--logs", type=int, default=200000)
+    k.add_argument("--codecs", nargs="+", choices=("json", "zjson"), default=["json", "zjson"])
+    k.add_argument("--iterations", type=int, default=1000)
+    k.add_argument("--warmup", type=int, default=50)
+    k.add_argument("--out", default="")
+    k.set_defaults(func=run_codec)
+
+    args = p.parse_args()
+    sys.exit(asyncio.run(args.func(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,22 @@
 import asyncio
+import functools
 import re
 from pyrogram import Client, filters
-from pyrogram.types import Message
+from pyrogram.types import Message, CallbackQuery
 
 from config import settings
 from database import Database, now_ts
 from userbot_manager import UserbotManager
+from broadcast import Broadcaster
+from ratelimit import KeyedLimiter
 
 from modules.start import start_keyboard, start_text
 from modules.pricing import pricing_text
 from modules.login import login_instructions
 from modules.dashboard import dashboard_text
 from modules.billing import buy_text, forwarded_caption
-from modules.admin import parse_approve, approved_text
-from modules.automation import help_text
+from modules.admin import parse_approve, approved_text, broadcast_status_text, rate_stats_text
+from modules.automation import help_text, fanout_result_text
 
 
 class ServiceBot:
@@ -27,18 +30,83 @@ class ServiceBot:
             bot_token=settings.BOT_TOKEN,
             in_memory=True,
         )
+        self.broadcaster = Broadcaster(db, self.app)
+        self.me = None
 
-    async def start(self):
+        # ইউজার প্রতি token bucket + MTProto connect এর global admission control
+        # (gate টা userbot manager এর, reconciler এর start/restart ও একই সীমায় চলে)
+        self.limiter = KeyedLimiter(settings.USER_RATE, settings.USER_BURST)
+        self.admission = userbots.admission
+        # "slow down" নোটিশও রেট-লিমিটেড, নাহলে স্প্যামারকে আমরাই স্প্যাম করব
+        self._notice_limiter = KeyedLimiter(1 / 30, 1)
+        self.rate_metrics = {"allowed": {}, "limited": {}, "busy": {}}
+
+    async def connect(self):
+        """শুধু Telegram লগইন (DB লাগে না), তাই স্টার্টআপে DB connect এর সাথে একসাথে চলতে পারে"""
         await self.app.start()
-        me = await self.app.get_me()
-        await self.db.add_log(0, "INFO", f"Bot started: @{me.username}")
+        self.me = await self.app.get_me()
+
+    async def start(self):
+        if not self.app.is_connected:
+            await self.connect()
+        await self.db.add_log(0, "INFO", f"Bot started: @{self.me.username}")
         self._register_handlers()
+        # restart এর আগে চলমান broadcast গুলো আবার শুরু
+        await self.broadcaster.start()
 
     async def stop(self):
+        await self.broadcaster.stop()
         await self.app.stop()
 
+    # কমান্ডের খরচ: cheap read থেকে নতুন MTProto login পর্যন্ত
+    # (/allow, /settpl এর restart reconciler করে, সেটা admission gate দিয়ে যায়)
+    COSTS = {"read": 1, "write": 2, "post": 4, "connect": 8}
+    EXPENSIVE = ("connect",)
+
+    def _count(self, kind: str, cost_class: str):
+        bucket = self.rate_metrics[kind]
+        bucket[cost_class] = bucket.get(cost_class, 0) + 1
+
+    def _guard(self, cost_class: str):
+        """হ্যান্ডলারের আগে per-user rate limit আর (দামি হলে) global admission চেক"""
+        def deco(func):
+            @functools.wraps(func)
+            async def wrapper(client, update):
+                uid = update.from_user.id if update.from_user else 0
+                if uid == settings.ADMIN_ID:
+                    return await func(client, update)
+
+                if not self.limiter.try_acquire(uid, self.COSTS[cost_class]):
+                    self._count("limited", cost_class)
+                    await self._reject(uid, update, "⏳ খুব দ্রুত কমান্ড দিচ্ছেন, একটু পরে চেষ্টা করুন।")
+                    return
+
+                if cost_class in self.EXPENSIVE:
+                    if self.admission.full():
+                        self._count("busy", cost_class)
+                        await self._reject(uid, update, "⏳ সার্ভার এখন ব্যস্ত, একটু পরে চেষ্টা করুন।")
+                        return
+                    self._count("allowed", cost_class)
+                    async with self.admission:
+                        return await func(client, update)
+
+                self._count("allowed", cost_class)
+                return await func(client, update)
+            return wrapper
+        return deco
+
+    async def _reject(self, uid: int, update, text: str):
+        try:
+            if isinstance(update, CallbackQuery):
+                await update.answer(text)
+            elif self._notice_limiter.try_acquire(uid):
+                await update.reply_text(text)
+        except Exception:
+            pass
+
     def _register_handlers(self):
         @self.app.on_message(filters.command("start"))
+        @self._guard("read")
         async def _start(_, m: Message):
             await self.db.upsert_user(m.from_user.id, m.from_user.username or "")
             await m.reply_text(
@@ -48,6 +116,7 @@ class ServiceBot:
             )
 
         @self.app.on_callback_query()
+        @self._guard("read")
         async def _cb(_, q):
             uid = q.from_user.id
             await self.db.upsert_user(uid, q.from_user.username or "")
@@ -62,8 +131,9 @@ class ServiceBot:
                 prem_ok, prem_until = await self.db.is_premium_active(uid)
                 sess = await self.db.get_session(uid)
                 cfg = await self.db.get_config(uid)
+                stats = await self.userbots.user_stats(uid, now_ts() - 86400)
                 await q.message.edit_text(
-                    dashboard_text(uid, u.get("username",""), prem_ok, prem_until, bool(sess), len(cfg.get("allow_chats", []))),
+                    dashboard_text(uid, u.get("username",""), prem_ok, prem_until, bool(sess), len(cfg.get("allow_chats", [])), stats),
                     disable_web_page_preview=True
                 )
             elif data == "cb_buy":
@@ -72,11 +142,13 @@ class ServiceBot:
             await q.answer()
 
         @self.app.on_message(filters.command("pricing"))
+        @self._guard("read")
         async def _pricing(_, m: Message):
             await self.db.upsert_user(m.from_user.id, m.from_user.username or "")
             await m.reply_text(pricing_text(settings.PRICE_WEEK_BDT))
 
         @self.app.on_message(filters.command("dashboard"))
+        @self._guard("read")
         async def _dash(_, m: Message):
             uid = m.from_user.id
             await self.db.upsert_user(uid, m.from_user.username or "")
@@ -84,14 +156,17 @@ class ServiceBot:
             prem_ok, prem_until = await self.db.is_premium_active(uid)
             sess = await self.db.get_session(uid)
             cfg = await self.db.get_config(uid)
-            await m.reply_text(dashboard_text(uid, u.get("username",""), prem_ok, prem_until, bool(sess), len(cfg.get("allow_chats", []))))
+            stats = await self.userbots.user_stats(uid, now_ts() - 86400)
+            await m.reply_text(dashboard_text(uid, u.get("username",""), prem_ok, prem_until, bool(sess), len(cfg.get("allow_chats", [])), stats))
 
         @self.app.on_message(filters.command("login"))
+        @self._guard("read")
         async def _login(_, m: Message):
             await self.db.upsert_user(m.from_user.id, m.from_user.username or "")
             await m.reply_text(login_instructions(), disable_web_page_preview=True)
 
         @self.app.on_message(filters.command("connect"))
+        @self._guard("connect")
         async def _connect(_, m: Message):
             uid = m.from_user.id
             await self.db.upsert_user(uid, m.from_user.username or "")
@@ -111,6 +186,7 @@ class ServiceBot:
 
         # -------- Billing: forward payment proofs to admin --------
         @self.app.on_message(filters.private & (filters.photo | filters.document))
+        @self._guard("write")
         async def _payment_proof(_, m: Message):
             uid = m.from_user.id
             await self.db.upsert_user(uid, m.from_user.username or "")
@@ -135,6 +211,7 @@ class ServiceBot:
             user_id, seconds = parsed
             until = max(now_ts(), now_ts()) + int(seconds)
             await self.db.set_premium(user_id, until)
+            self.userbots.invalidate_premium(user_id)
             await self.db.add_log(user_id, "INFO", "Premium approved by admin", {"until": until})
             await m.reply_text(approved_text(user_id, until))
             try:
@@ -142,13 +219,54 @@ class ServiceBot:
             except Exception:
                 pass
 
+        # -------- Admin broadcast --------
+        @self.app.on_message(filters.user(settings.ADMIN_ID) & filters.command("broadcast"))
+        async def _broadcast(_, m: Message):
+            parts = m.text.split(maxsplit=1)
+            if len(parts) < 2 or not parts[1].strip():
+                await m.reply_text("❌ ব্যবহার: `/broadcast আপনার মেসেজ`")
+                return
+            bid = await self.broadcaster.start_new(parts[1].strip())
+            await m.reply_text(f"📣 Broadcast started: `{bid}`\nStatus: `/bcstatus {bid}` | Pause: `/bcpause {bid}`")
+
+        @self.app.on_message(filters.user(settings.ADMIN_ID) & filters.command(["bcpause", "bcresume"]))
+        async def _broadcast_ctl(_, m: Message):
+            parts = m.text.split()
+            if len(parts) < 2:
+                await m.reply_text("❌ ব্যবহার: `/bcpause <id>` বা `/bcresume <id>`")
+                return
+            if m.command[0] == "bcpause":
+                ok = await self.broadcaster.pause(parts[1])
+            else:
+                ok = await self.broadcaster.resume(parts[1])
+            await m.reply_text(f"✅ {m.command[0][2:].capitalize()}d `{parts[1]}`" if ok else "❌ Broadcast not found or wrong state")
+
+        @self.app.on_message(filters.user(settings.ADMIN_ID) & filters.command("bcstatus"))
+        async def _broadcast_status(_, m: Message):
+            parts = m.text.split()
+            if len(parts) >= 2:
+                ids = [parts[1]]
+            else:
+                ids = [b["broadcast_id"] for b in await self.db.list_broadcasts(limit=5)]
+            out = []
+            for bid in ids:
+                b = await self.broadcaster.status(bid)
+                if b:
+                    out.append(broadcast_status_text(b))
+            await m.reply_text("\n\n".join(out) if out else "ℹ️ কোনো broadcast নেই।")
+
+        @self.app.on_message(filters.user(settings.ADMIN_ID) & filters.command("ratestats"))
+        async def _ratestats(_, m: Message):
+            await m.reply_text(rate_stats_text(self.rate_metrics, self.admission, self.userbots.reconcile_metrics))
+
         # -------- Automation commands --------
         @self.app.on_message(filters.command("help"))
+        @self._guard("read")
         async def _help(_, m: Message):
             await m.reply_text(help_text())
 
-        # --- IMPORTANT UPDATE: Restart logic added here ---
         @self.app.on_message(filters.command("allow"))
+        @self._guard("write")
         async def _allow(_, m: Message):
             uid = m.from_user.id
             await self.db.upsert_user(uid, m.from_user.username or "")
@@ -161,29 +279,21 @@ class ServiceBot:
             except Exception:
                 await m.reply_text("❌ chat_id সংখ্যা হতে হবে (যেমন -100...)")
                 return
-            
+
             # DB Update
             cfg = await self.db.get_config(uid)
             allow = set(int(x) for x in cfg.get("allow_chats", []))
             allow.add(chat_id)
             await self.db.set_allow_chats(uid, sorted(list(allow)))
             await self.db.add_log(uid, "INFO", "Allow chat added", {"chat_id": chat_id})
-            
-            # --- RESTART CLIENT TO APPLY NEW TARGET GROUP ---
-            # এটি আপনার userbot_manager.py এর নতুন restart_client মেথড কল করবে
-            await m.reply_text(f"✅ Added allow chat: `{chat_id}`\n♻️ Restarting monitor to apply changes...")
-            
-            try:
-                # যদি userbot_manager.py এ restart_client না থাকে, তবে ensure_client কল হবে
-                if hasattr(self.userbots, 'restart_client'):
-                    await self.userbots.restart_client(uid)
-                else:
-                    # Fallback if method missing (though you should add it to manager)
-                    await self.userbots.ensure_client(uid)
-            except Exception as e:
-                await self.db.add_log(uid, "ERROR", f"Restart failed: {e}")
+
+            # restart নয়: reconciler কয়েক সেকেন্ডের মধ্যে চলমান ক্লায়েন্টের filter আপডেট করবে,
+            # আর ক্লায়েন্ট না চললে (যেমন deploy এর পর) চালু করবে
+            self.userbots.mark_dirty(uid, "start")
+            await m.reply_text(f"✅ Added allow chat: `{chat_id}`\n♻️ কয়েক সেকেন্ডের মধ্যে মনিটরে যোগ হবে।")
 
         @self.app.on_message(filters.command("allowlist"))
+        @self._guard("read")
         async def _allowlist(_, m: Message):
             uid = m.from_user.id
             cfg = await self.db.get_config(uid)
@@ -194,6 +304,7 @@ class ServiceBot:
             await m.reply_text("✅ Allowlist:\n" + "\n".join([f"• `{x}`" for x in allow]))
 
         @self.app.on_message(filters.command("settpl"))
+        @self._guard("write")
         async def _settpl(_, m: Message):
             uid = m.from_user.id
             await self.db.upsert_user(uid, m.from_user.username or "")
@@ -205,22 +316,31 @@ class ServiceBot:
             templates = cfg.get("templates", [])
             templates.append({"text": parts[1].strip()})
             await self.db.set_templates(uid, templates)
+            self.userbots.mark_dirty(uid, "config")
             await self.db.add_log(uid, "INFO", "Template added", {"count": len(templates)})
             await m.reply_text(f"✅ Template added. Total: {len(templates)}")
 
         @self.app.on_message(filters.command("post"))
+        @self._guard("post")
         async def _post(_, m: Message):
             uid = m.from_user.id
             parts = m.text.split()
             if len(parts) < 3:
-                await m.reply_text("❌ ব্যবহার: `/post -100xxxxxxxxxx 0`")
+                await m.reply_text("❌ ব্যবহার: `/post -100xxxxxxxxxx 0` অথবা `/post all 0 [chat_id ...]`")
                 return
-            chat_id = int(parts[1])
             idx = int(parts[2])
+            if parts[1].lower() == "all":
+                # fan-out: allowlist এর সব চ্যাটে (বা দেওয়া সাবসেটে)
+                chat_ids = [int(x) for x in parts[3:]]
+                res = await self.userbots.post_fanout(uid, idx, chat_ids or None)
+                await m.reply_text(fanout_result_text(res))
+                return
+            chat_id = int(parts[1])
             ok = await self.userbots.post_template(uid, chat_id, idx)
             await m.reply_text("✅ Posted" if ok else "❌ Blocked/Failed (premium/admin/allowlist check)")
 
         @self.app.on_message(filters.command("schedule"))
+        @self._guard("write")
         async def _schedule(_, m: Message):
             uid = m.from_user.id
             parts = m.text.split()
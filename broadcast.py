@@ -0,0 +1,195 @@
+import asyncio
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait, RPCError
+
+from config import settings
+from database import Database, now_ts
+from ratelimit import TokenBucket
+
+
+class Broadcaster:
+    """
+    Admin broadcast: users টেবিল থেকে cursor দিয়ে ব্যাচে ব্যাচে user_id এনে
+    global rate limit মেনে পাঠায়। প্রতিটা ব্যাচের পর cursor + recipient স্ট্যাটাস DB তে লেখা হয়,
+    তাই restart হলে যেখানে থেমেছিল সেখান থেকে আবার চলে। pause/resume DB স্ট্যাটাস দিয়ে।
+    একাধিক instance একই DB শেয়ার করলে lease (owner + lease_until) যার কাছে সে-ই চালায়;
+    owner মারা গেলে lease শেষে অন্য instance নিয়ে নেয়।
+    """
+
+    def __init__(self, db: Database, app: Client):
+        self.db = db
+        self.app = app
+        self.limiter = TokenBucket(settings.BROADCAST_RATE, settings.BROADCAST_RATE)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # এই প্রসেসে চলার সময়কার throughput হিসাব: {broadcast_id: (started_monotonic, sent_at_start)}
+        self._runs: Dict[str, Tuple[float, int]] = {}
+        self._progress: Dict[str, int] = {}
+        # lease এ এই instance এর পরিচয়
+        self.owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._watch_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.resume_running()
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        # অন্য instance এ resume হওয়া বা lease ছেড়ে দেওয়া/মেয়াদ শেষ হওয়া broadcast ধরার জন্য
+        while True:
+            await asyncio.sleep(settings.BROADCAST_LEASE / 2)
+            try:
+                await self.resume_running()
+            except Exception as e:
+                await self.db.add_log(0, "ERROR", f"Broadcast watch failed: {e}")
+
+    async def start_new(self, text: str) -> str:
+        broadcast_id = uuid.uuid4().hex[:10]
+        total = await self.db.count_active_users()
+        await self.db.create_broadcast(broadcast_id, text, total)
+        await self.db.add_log(0, "INFO", "Broadcast started", {"broadcast_id": broadcast_id, "total": total})
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    async def resume_running(self):
+        """running broadcast গুলোর মধ্যে যেগুলোর lease কারো কাছে নেই (বা মেয়াদ শেষ) সেগুলো চালু"""
+        now = now_ts()
+        for b in await self.db.list_broadcasts(status="running", limit=100):
+            if b.get("owner") in (None, self.owner) or (b.get("lease_until") or 0) < now:
+                self._spawn(b["broadcast_id"])
+
+    async def pause(self, broadcast_id: str) -> bool:
+        b = await self.db.get_broadcast(broadcast_id)
+        if not b or b["status"] != "running":
+            return False
+        # যে instance চালাচ্ছে সে পরের ব্যাচের আগে DB স্ট্যাটাস দেখে থামবে
+        await self.db.set_broadcast_status(broadcast_id, "paused")
+        return True
+
+    async def resume(self, broadcast_id: str) -> bool:
+        b = await self.db.get_broadcast(broadcast_id)
+        if not b or b["status"] != "paused":
+            return False
+        await self.db.set_broadcast_status(broadcast_id, "running")
+        # lease অন্য কারো কাছে থাকলে _run claim না পেয়ে ফিরে যাবে, owner ই চালিয়ে যাবে
+        self._spawn(broadcast_id)
+        return True
+
+    async def stop(self):
+        # DB স্ট্যাটাস running থাকে আর lease ছেড়ে দেওয়া হয়; অন্য instance বা পরের স্টার্ট আবার ধরবে
+        if self._watch_task:
+            self._watch_task.cancel()
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+
+    async def status(self, broadcast_id: str) -> Optional[Dict]:
+        b = await self.db.get_broadcast(broadcast_id)
+        if not b:
+            return None
+        done = b["sent"] + b["failed"]
+        b["done"] = done
+        b["rate"] = 0.0
+        b["eta"] = None
+        run = self._runs.get(broadcast_id)
+        if run and b["status"] == "running":
+            started, done_at_start = run
+            elapsed = time.monotonic() - started
+            processed = self._progress.get(broadcast_id, done) - done_at_start
+            if elapsed > 0 and processed > 0:
+                b["rate"] = processed / elapsed
+                b["eta"] = max(0, b["total"] - done) / b["rate"]
+        return b
+
+    def _spawn(self, broadcast_id: str):
+        task = self.tasks.get(broadcast_id)
+        if task and not task.done():
+            return
+        self.tasks[broadcast_id] = asyncio.create_task(self._run(broadcast_id))
+
+    async def _heartbeat(self, broadcast_id: str):
+        while True:
+            await asyncio.sleep(settings.BROADCAST_LEASE / 3)
+            try:
+                # ব্যর্থ হলে (lease হারানো / pause) _run পরের ব্যাচের আগেই ধরবে
+                await self.db.claim_broadcast(broadcast_id, self.owner, settings.BROADCAST_LEASE)
+            except Exception:
+                pass
+
+    async def _run(self, broadcast_id: str):
+        claimed = False
+        heartbeat: Optional[asyncio.Task] = None
+        try:
+            if not await self.db.claim_broadcast(broadcast_id, self.owner, settings.BROADCAST_LEASE):
+                return  # অন্য instance চালাচ্ছে, বা আর running নেই
+            claimed = True
+            heartbeat = asyncio.create_task(self._heartbeat(broadcast_id))
+
+            b = await self.db.get_broadcast(broadcast_id)
+            text = b["text"]
+            cursor = int(b["cursor"] or 0)
+            done = b["sent"] + b["failed"]
+            self._runs[broadcast_id] = (time.monotonic(), done)
+            self._progress[broadcast_id] = done
+            sem = asyncio.Semaphore(settings.BROADCAST_CONCURRENCY)
+
+            async def _one(uid: int) -> Tuple[int, str, Optional[str]]:
+                async with sem:
+                    return (uid, *await self._send_one(uid, text))
+
+            while True:
+                # প্রতি ব্যাচের আগে DB থেকে: অন্য instance এ /bcpause হলে বা lease হারালে থামা
+                b = await self.db.get_broadcast(broadcast_id)
+                if not b or b["status"] != "running" or b.get("owner") != self.owner:
+                    return
+                ids = await self.db.iter_user_ids(cursor, settings.BROADCAST_BATCH)
+                if not ids:
+                    break
+                # আগের রানে লেখা হয়ে গেছে এমন recipient বাদ (crash এর পর ডুপ্লিকেট এড়াতে)
+                skip = set(await self.db.get_broadcast_recipients_done(broadcast_id, ids))
+                results: List[Tuple[int, str, Optional[str]]] = list(
+                    await asyncio.gather(*(_one(uid) for uid in ids if uid not in skip))
+                )
+                cursor = ids[-1]
+                await self.db.record_broadcast_batch(broadcast_id, cursor, results)
+                self._progress[broadcast_id] += len(results)
+
+            await self.db.set_broadcast_status(broadcast_id, "done")
+            b = await self.db.get_broadcast(broadcast_id)
+            await self.db.add_log(0, "INFO", "Broadcast finished",
+                                  {"broadcast_id": broadcast_id, "sent": b["sent"], "failed": b["failed"]})
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            await self.db.set_broadcast_status(broadcast_id, "paused")
+            await self.db.add_log(0, "ERROR", f"Broadcast {broadcast_id} stopped: {e}")
+        finally:
+            if heartbeat:
+                heartbeat.cancel()
+            if claimed:
+                try:
+                    await self.db.release_broadcast(broadcast_id, self.owner)
+                except Exception:
+                    pass
+            self.tasks.pop(broadcast_id, None)
+            self._runs.pop(broadcast_id, None)
+            self._progress.pop(broadcast_id, None)
+
+    async def _send_one(self, user_id: int, text: str) -> Tuple[str, Optional[str]]:
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.app.send_message(user_id, text)
+                return "sent", None
+            except FloodWait as e:
+                # পুরো broadcast থামিয়ে অপেক্ষা, তারপর একই recipient আবার
+                self.limiter.pause_for(e.value)
+            except RPCError as e:
+                # blocked / deactivated / peer invalid ইত্যাদি: retry করে লাভ নেই
+                return "failed", e.ID or type(e).__name__
+            except Exception as e:
+                return "failed", str(e)
@@ -0,0 +1,77 @@
+import json
+import zlib
+from typing import Any
+
+# orjson থাকলে encode/decode দ্রুত; না থাকলে stdlib json (স্টোর করা ফরম্যাট একই থাকে)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# SQLite এ JSON কলামের row ফরম্যাট:
+#   str                  -> plain JSON text (পুরনো row গুলোও এটাই)
+#   bytes b"Z1" + ...    -> zlib compressed JSON (stdlib দিয়েই পড়া যায়)
+ZLIB_TAG = b"Z1"
+CODECS = ("json", "zjson")
+
+
+def _dumps(value: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # orjson যা পারে না (64-bit এর বড় int, non-str key ইত্যাদি) stdlib এ
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(raw) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class RowCodec:
+    """
+    configs.allow_chats / configs.templates / logs.meta কলামের encode/decode।
+    decode সবসময় row এর tag দেখে করে, তাই DB_CODEC বদলালেও পুরনো row পড়া যায়।
+    zjson এ compress করে ছোট না হলে plain JSON রাখা হয় (ছোট list/dict এর জন্য)।
+    """
+
+    def __init__(self, name: str = "json", level: int = 6):
+        if name not in CODECS:
+            raise ValueError(f"Unknown DB_CODEC {name!r} (expected one of {', '.join(CODECS)})")
+        self.name = name
+        self.level = level
+
+    def encode(self, value: Any):
+        raw = _dumps(value)
+        if self.name == "zjson":
+            packed = ZLIB_TAG + zlib.compress(raw, self.level)
+            if len(packed) < len(raw):
+                return packed
+        return raw.decode("utf-8")
+
+    def decode(self, stored, default: Any = None) -> Any:
+        if stored is None or stored == "" or stored == b"":
+            return default
+        if isinstance(stored, str):
+            return _loads(stored)
+        stored = bytes(stored)
+        if stored[:2] == ZLIB_TAG:
+            return _loads(zlib.decompress(stored[2:]))
+        raise ValueError(f"Unknown row codec tag {stored[:2]!r}")
+
+    def reencode(self, stored):
+        """
+        row এর ফরম্যাট (tag) বর্তমান codec থেকে আলাদা হলে নতুন মান, নইলে None।
+        একই ফরম্যাটের row (যেমন json এ পুরনো plain JSON text) ছোঁয়া হয় না।
+        """
+        if stored is None:
+            return None
+        is_text = isinstance(stored, str)
+        if is_text == (self.name == "json"):
+            return None
+        new = self.encode(self.decode(stored))
+        # zjson এ compress করে ছোট না হলে plain ই থাকে
+        return None if isinstance(new, str) == is_text else new
@@ -16,12 +16,58 @@ class Settings:
     # Database
     MONGODB_URI: str = os.environ.get("MONGODB_URI", "")  # optional
     SQLITE_PATH: str = os.environ.get("SQLITE_PATH", "app.db")
+    # Mongo change streams দিয়ে অন্য instance এর config/premium পরিবর্তন শোনা (replica set লাগে)
+    CHANGE_STREAMS: bool = os.environ.get("CHANGE_STREAMS", "1") == "1"
+    # change stream না চললে config/premium ক্যাশ কত সেকেন্ড রাখা হবে (0 = প্রতিবার DB থেকে)
+    CACHE_TTL: int = int(os.environ.get("CACHE_TTL", "30"))
+    # SQLite এ config/log meta কলামের ফরম্যাট: json (plain text) বা zjson (zlib compressed, ছোট ফাইল)
+    DB_CODEC: str = os.environ.get("DB_CODEC", "json")
+    DB_REENCODE: bool = os.environ.get("DB_REENCODE", "1") == "1"  # স্টার্টআপে পুরনো row বর্তমান codec এ লেখা
 
     # Pricing
     PRICE_WEEK_BDT: int = int(os.environ.get("PRICE_WEEK_BDT", "74"))
 
+    # Posting
+    DEBOUNCE_SECONDS: int = int(os.environ.get("DEBOUNCE_SECONDS", "15"))  # গ্রুপ চুপ থাকলে কত সেকেন্ড পর পোস্ট
+    PENDING_MAX_AGE: int = int(os.environ.get("PENDING_MAX_AGE", "3600"))  # এর চেয়ে পুরনো সেভ করা টাইমার restore হবে না
+    SEND_LEDGER_TTL: int = int(os.environ.get("SEND_LEDGER_TTL", "86400"))
+    SEND_LEDGER_PRUNE_INTERVAL: int = int(os.environ.get("SEND_LEDGER_PRUNE_INTERVAL", "3600"))  # কত পরপর পুরনো ledger row মোছা
+    POST_CONCURRENCY: int = int(os.environ.get("POST_CONCURRENCY", "3"))  # অ্যাকাউন্ট প্রতি concurrent send
+    FLOODWAIT_RETRY_MAX: int = int(os.environ.get("FLOODWAIT_RETRY_MAX", "30"))  # এর চেয়ে ছোট FloodWait হলে retry
+
+    # Service bot rate limit
+    USER_RATE: float = float(os.environ.get("USER_RATE", "1"))  # ইউজার প্রতি token/sec
+    USER_BURST: float = float(os.environ.get("USER_BURST", "10"))
+    ADMISSION_MAX_RUNNING: int = int(os.environ.get("ADMISSION_MAX_RUNNING", "4"))  # একসাথে restart/connect
+    ADMISSION_MAX_WAITING: int = int(os.environ.get("ADMISSION_MAX_WAITING", "32"))
+
+    # Per-chat activity stats
+    STATS_BUCKETS: int = int(os.environ.get("STATS_BUCKETS", "60"))  # লাইভ উইন্ডো = BUCKETS × BUCKET_SECONDS
+    STATS_BUCKET_SECONDS: int = int(os.environ.get("STATS_BUCKET_SECONDS", "60"))
+    STATS_FLUSH_INTERVAL: int = int(os.environ.get("STATS_FLUSH_INTERVAL", "60"))
+
+    # Userbot supervisor (health check / reconnect)
+    PROBE_INTERVAL: int = int(os.environ.get("PROBE_INTERVAL", "60"))
+    PROBE_TIMEOUT: int = int(os.environ.get("PROBE_TIMEOUT", "10"))
+    PROBE_DEAD_AFTER: int = int(os.environ.get("PROBE_DEAD_AFTER", "3"))  # পরপর কতবার ফেল করলে dead
+    PROBE_CONCURRENCY: int = int(os.environ.get("PROBE_CONCURRENCY", "10"))
+    RECONNECT_BASE_DELAY: int = int(os.environ.get("RECONNECT_BASE_DELAY", "2"))
+    RECONNECT_MAX_DELAY: int = int(os.environ.get("RECONNECT_MAX_DELAY", "300"))
+    # config পরিবর্তন (/allow, /settpl, change stream) কত সেকেন্ড জমিয়ে একসাথে প্রয়োগ
+    RECONCILE_WINDOW: float = float(os.environ.get("RECONCILE_WINDOW", "1"))
+    RECONCILE_CONCURRENCY: int = int(os.environ.get("RECONCILE_CONCURRENCY", "4"))  # একসাথে কতগুলো full reconnect
+
+    # Admin broadcast
+    BROADCAST_RATE: float = float(os.environ.get("BROADCAST_RATE", "20"))  # messages/sec (Bot API limit ~30)
+    BROADCAST_BATCH: int = int(os.environ.get("BROADCAST_BATCH", "50"))
+    BROADCAST_CONCURRENCY: int = int(os.environ.get("BROADCAST_CONCURRENCY", "8"))
+    BROADCAST_LEASE: int = int(os.environ.get("BROADCAST_LEASE", "60"))  # instance এর lease (সেকেন্ড), heartbeat এতে নবায়ন
+
     # Web
     PUBLIC_BASE_URL: str = os.environ.get("PUBLIC_BASE_URL", "")  # optional (Render URL)
+    LOG_RING_SIZE: int = int(os.environ.get("LOG_RING_SIZE", "1000"))  # লাইভ log stream এর resume বাফার
+    LOG_SUBSCRIBER_BUFFER: int = int(os.environ.get("LOG_SUBSCRIBER_BUFFER", "256"))
+    ADMIN_API_TOKEN: str = os.environ.get("ADMIN_API_TOKEN", "")  # /api/admin/* এর জন্য (খালি হলে বন্ধ)
 
     # Security note: production-এ session string encrypt করা উচিত
     # এখানে brevity-এর জন্য plain রাখা হয়েছে। চাইলে পরে encryption যোগ করে দেব।
@@ -1,25 +1,42 @@
 import time
-import json
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import importlib.util
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
+from codec import RowCodec
 from config import settings
+from loghub import LogHub
+
+# ড্রাইভার lazy import: যে backend চলবে শুধু সেটাই connect() এর সময় import হয়
+# (motor/pymongo import বেশ ভারী, SQLite মোডে দরকারই নেই)
 
 # --- Mongo (preferred) ---
-_mongo_ok = False
-try:
+_mongo_ok = importlib.util.find_spec("motor") is not None
+
+
+def _load_mongo_driver():
+    global AsyncIOMotorClient, UpdateOne, DuplicateKeyError, OperationFailure, PyMongoError
     from motor.motor_asyncio import AsyncIOMotorClient
-    _mongo_ok = True
-except Exception:
-    _mongo_ok = False
+    from pymongo import UpdateOne
+    from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
 
 # --- SQLite fallback ---
-import aiosqlite
+def _load_sqlite_driver():
+    global aiosqlite
+    import aiosqlite
 
 
 def now_ts() -> int:
     return int(time.time())
 
 
+DEFAULT_TEMPLATES = [
+    {"text": "Hello! This is a scheduled update."},
+    {"text": "Reminder: Please check the pinned message."}
+]
+
+
 class Database:
     """
     Collections / tables:
@@ -29,26 +46,44 @@ class Database:
       logs: { ts, user_id, level, message, meta }
       payments: { ts, user_id, status, note }
       jobs: { job_id, user_id, chat_id, template_idx, run_at, status }
+      pending_posts: { user_id, chat_id, deadline }   (shutdown এ সেভ করা debounce টাইমার)
+      send_ledger: { send_key, user_id, chat_id, status, ts }
+      chat_stats: { user_id, chat_id, bucket_ts, seen, resets, sends, fails }   (ঘণ্টা ভিত্তিক aggregate)
+      broadcasts: { broadcast_id, text, status, cursor, total, sent, failed, created_at, updated_at, owner, lease_until }
+      broadcast_recipients: { broadcast_id, user_id, status, error, ts }
+      meta: { key, value }   (অভ্যন্তরীণ চিহ্ন, যেমন কোন codec এ re-encode শেষ হয়েছে)
     """
 
-    def __init__(self):
-        self.mode = "mongo" if (settings.MONGODB_URI and _mongo_ok) else "sqlite"
-        self._mongo = None
-        self._db = None
+    def __init__(self, mongo_uri: Optional[str] = None, sqlite_path: Optional[str] = None, mongo_db: Any = None):
+        # ডিফল্টে settings থেকে; bench/conformance স্ক্রিপ্ট দুই backend একসাথে চালাতে override করে
+        # (mongo_db: আগে থেকে বানানো motor-compatible database, যেমন mongomock-motor)
+        self.mongo_uri = settings.MONGODB_URI if mongo_uri is None else mongo_uri
+        self.sqlite_path = sqlite_path or settings.SQLITE_PATH
+        self.mode = "mongo" if ((self.mongo_uri or mongo_db is not None) and _mongo_ok) else "sqlite"
+        self._mongo = mongo_db.client if mongo_db is not None else None
+        self._db = mongo_db
         self._sqlite = None
+        self.indexes_ready = False
+        # watch_changes এর stream চালু আছে কিনা (UserbotManager ক্যাশের TTL এর জন্য)
+        self.change_stream_live = False
+        # লাইভ log tail (SSE) এর জন্য in-memory fan-out; DB তে query লাগে না
+        self.log_hub = LogHub(settings.LOG_RING_SIZE, settings.LOG_SUBSCRIBER_BUFFER)
+        # SQLite এর JSON কলামের ফরম্যাট (Mongo নিজেই BSON এ রাখে)
+        self.codec = RowCodec(settings.DB_CODEC)
+        # SQLite এ config এর read-merge-write (bulk import) আর /allow, /settpl এর লেখা একটার পর একটা
+        self._config_lock = asyncio.Lock()
 
     async def connect(self):
         if self.mode == "mongo":
-            self._mongo = AsyncIOMotorClient(settings.MONGODB_URI)
-            self._db = self._mongo.get_default_database()
-            # indexes
-            await self._db.users.create_index("user_id", unique=True)
-            await self._db.sessions.create_index("user_id", unique=True)
-            await self._db.configs.create_index("user_id", unique=True)
-            await self._db.jobs.create_index([("user_id", 1), ("run_at", 1)])
-            await self._db.logs.create_index([("ts", -1)])
+            _load_mongo_driver()
+            if self._db is None:
+                self._mongo = AsyncIOMotorClient(self.mongo_uri)
+                # motor lazy connect করে; readiness এর জন্য এখনই সার্ভার reachable কিনা দেখা
+                await self._mongo.admin.command("ping")
+                self._db = self._mongo.get_default_database()
         else:
-            self._sqlite = await aiosqlite.connect(settings.SQLITE_PATH)
+            _load_sqlite_driver()
+            self._sqlite = await aiosqlite.connect(self.sqlite_path)
             await self._sqlite.execute("""
                 CREATE TABLE IF NOT EXISTS users(
                   user_id INTEGER PRIMARY KEY,
@@ -92,7 +127,101 @@ class Database:
                   status TEXT
                 )
             """)
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS pending_posts(
+                  user_id INTEGER,
+                  chat_id INTEGER,
+                  deadline REAL,
+                  PRIMARY KEY(user_id, chat_id)
+                )
+            """)
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS send_ledger(
+                  send_key TEXT PRIMARY KEY,
+                  user_id INTEGER,
+                  chat_id INTEGER,
+                  status TEXT,
+                  ts INTEGER
+                )
+            """)
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS chat_stats(
+                  user_id INTEGER,
+                  chat_id INTEGER,
+                  bucket_ts INTEGER,
+                  seen INTEGER,
+                  resets INTEGER,
+                  sends INTEGER,
+                  fails INTEGER,
+                  PRIMARY KEY(user_id, chat_id, bucket_ts)
+                )
+            """)
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts(
+                  broadcast_id TEXT PRIMARY KEY,
+                  text TEXT,
+                  status TEXT,
+                  cursor INTEGER,
+                  total INTEGER,
+                  sent INTEGER,
+                  failed INTEGER,
+                  created_at INTEGER,
+                  updated_at INTEGER,
+                  owner TEXT,
+                  lease_until INTEGER
+                )
+            """)
+            # পুরনো DB: পরে যোগ হওয়া কলাম
+            cur = await self._sqlite.execute("PRAGMA table_info(broadcasts)")
+            cols = {r[1] for r in await cur.fetchall()}
+            for col, typ in (("owner", "TEXT"), ("lease_until", "INTEGER")):
+                if col not in cols:
+                    await self._sqlite.execute(f"ALTER TABLE broadcasts ADD COLUMN {col} {typ}")
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS broadcast_recipients(
+                  broadcast_id TEXT,
+                  user_id INTEGER,
+                  status TEXT,
+                  error TEXT,
+                  ts INTEGER,
+                  PRIMARY KEY(broadcast_id, user_id)
+                )
+            """)
+            await self._sqlite.execute("""
+                CREATE TABLE IF NOT EXISTS meta(
+                  key TEXT PRIMARY KEY,
+                  value TEXT
+                )
+            """)
+            await self._sqlite.commit()
+
+    async def ensure_indexes(self):
+        """
+        Index তৈরি আলাদা রাখা হয়েছে যাতে স্টার্টআপ এর জন্য অপেক্ষা না করে ব্যাকগ্রাউন্ডে চলতে পারে।
+        সব IF NOT EXISTS / idempotent, তাই প্রতিবার চালানো নিরাপদ।
+        """
+        if self.mode == "mongo":
+            await asyncio.gather(
+                self._db.users.create_index("user_id", unique=True),
+                self._db.sessions.create_index("user_id", unique=True),
+                self._db.configs.create_index("user_id", unique=True),
+                self._db.jobs.create_index([("user_id", 1), ("run_at", 1)]),
+                self._db.logs.create_index([("ts", -1)]),
+                self._db.pending_posts.create_index([("user_id", 1), ("chat_id", 1)], unique=True),
+                self._db.send_ledger.create_index("send_key", unique=True),
+                self._db.send_ledger.create_index("ts"),
+                self._db.chat_stats.create_index([("user_id", 1), ("chat_id", 1), ("bucket_ts", 1)], unique=True),
+                self._db.chat_stats.create_index("bucket_ts"),
+                self._db.broadcasts.create_index("broadcast_id", unique=True),
+                self._db.broadcast_recipients.create_index([("broadcast_id", 1), ("user_id", 1)], unique=True),
+            )
+        else:
+            await self._sqlite.execute("CREATE INDEX IF NOT EXISTS idx_logs_ts ON logs(ts)")
+            await self._sqlite.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, run_at)")
+            await self._sqlite.execute("CREATE INDEX IF NOT EXISTS idx_send_ledger_ts ON send_ledger(ts)")
+            await self._sqlite.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_ts ON chat_stats(bucket_ts)")
             await self._sqlite.commit()
+        self.indexes_ready = True
 
     async def close(self):
         if self.mode == "mongo":
@@ -128,7 +257,14 @@ class Database:
 
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         if self.mode == "mongo":
-            return await self._db.users.find_one({"user_id": user_id}, {"_id": 0})
+            doc = await self._db.users.find_one({"user_id": user_id}, {"_id": 0})
+            if doc:
+                # SQLite এর মতো একই shape (upsert_user এ premium_until সেট হয় না)
+                doc.setdefault("username", "")
+                doc.setdefault("created_at", 0)
+                doc.setdefault("premium_until", 0)
+                doc.setdefault("is_active", True)
+            return doc
         cur = await self._sqlite.execute(
             "SELECT user_id, username, created_at, premium_until, is_active FROM users WHERE user_id=?",
             (user_id,)
@@ -146,9 +282,19 @@ class Database:
 
     async def set_premium(self, user_id: int, premium_until: int):
         if self.mode == "mongo":
-            await self._db.users.update_one({"user_id": user_id}, {"$set": {"premium_until": premium_until}}, upsert=True)
+            await self._db.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"premium_until": premium_until},
+                 "$setOnInsert": {"username": "", "created_at": 0, "is_active": True}},
+                upsert=True
+            )
         else:
-            await self._sqlite.execute("UPDATE users SET premium_until=? WHERE user_id=?", (premium_until, user_id))
+            # Mongo এর upsert এর মতো: আগে /start না করা ইউজারকেও approve করা যায়
+            await self._sqlite.execute(
+                "INSERT INTO users(user_id, username, created_at, premium_until, is_active) VALUES(?,?,?,?,?) "
+                "ON CONFLICT(user_id) DO UPDATE SET premium_until=excluded.premium_until",
+                (user_id, "", 0, premium_until, 1)
+            )
             await self._sqlite.commit()
 
     async def is_premium_active(self, user_id: int) -> Tuple[bool, int]:
@@ -177,95 +323,296 @@ class Database:
     async def get_session(self, user_id: int) -> Optional[str]:
         if self.mode == "mongo":
             doc = await self._db.sessions.find_one({"user_id": user_id}, {"_id": 0, "session_string": 1})
-            return doc["session_string"] if doc else None
+            return (doc["session_string"] or None) if doc else None
         cur = await self._sqlite.execute("SELECT session_string FROM sessions WHERE user_id=?", (user_id,))
         row = await cur.fetchone()
-        return row[0] if row else None
+        return (row[0] or None) if row else None
 
     async def get_users_with_sessions(self) -> List[int]:
         if self.mode == "mongo":
-            cursor = self._db.sessions.find({}, {"_id": 0, "user_id": 1})
+            cursor = self._db.sessions.find({"session_string": {"$nin": ["", None]}}, {"_id": 0, "user_id": 1})
             return [d["user_id"] async for d in cursor]
-        cur = await self._sqlite.execute("SELECT user_id FROM sessions")
+        cur = await self._sqlite.execute("SELECT user_id FROM sessions WHERE session_string<>''")
         rows = await cur.fetchall()
         return [int(r[0]) for r in rows]
 
     # ---------------- Config ----------------
     async def get_config(self, user_id: int) -> Dict[str, Any]:
-        default_templates = [
-            {"text": "Hello! This is a scheduled update."},
-            {"text": "Reminder: Please check the pinned message."}
-        ]
+        default_templates = DEFAULT_TEMPLATES
         if self.mode == "mongo":
-            doc = await self._db.configs.find_one({"user_id": user_id}, {"_id": 0})
+            doc = await self._db.configs.find_one({"user_id": user_id}, {"_id": 0, "updated_at": 0})
             if not doc:
                 return {"user_id": user_id, "allow_chats": [], "templates": default_templates}
             doc.setdefault("allow_chats", [])
-            doc.setdefault("templates", default_templates)
+            # খালি টেমপ্লেট লিস্টেও ডিফল্ট (SQLite এর মতো)
+            if not doc.get("templates"):
+                doc["templates"] = default_templates
             return doc
 
         cur = await self._sqlite.execute("SELECT allow_chats, templates FROM configs WHERE user_id=?", (user_id,))
         row = await cur.fetchone()
         if not row:
             return {"user_id": user_id, "allow_chats": [], "templates": default_templates}
-        allow_chats = json.loads(row[0] or "[]")
-        templates = json.loads(row[1] or "[]") or default_templates
+        allow_chats = self.codec.decode(row[0], [])
+        templates = self.codec.decode(row[1], []) or default_templates
         return {"user_id": user_id, "allow_chats": allow_chats, "templates": templates}
 
     async def set_allow_chats(self, user_id: int, allow_chats: List[int]):
-        cfg = await self.get_config(user_id)
-        cfg["allow_chats"] = allow_chats
-        await self._upsert_config(user_id, cfg)
+        await self._upsert_config(user_id, "allow_chats", allow_chats)
 
     async def set_templates(self, user_id: int, templates: List[Dict[str, Any]]):
-        cfg = await self.get_config(user_id)
-        cfg["templates"] = templates
-        await self._upsert_config(user_id, cfg)
+        await self._upsert_config(user_id, "templates", templates)
 
-    async def _upsert_config(self, user_id: int, cfg: Dict[str, Any]):
+    async def _upsert_config(self, user_id: int, field: str, value: list):
+        # শুধু এই ফিল্ডটা লেখা হয়, অন্যটা আগের মতোই থাকে (নতুন row এ খালি)
+        other = "templates" if field == "allow_chats" else "allow_chats"
         if self.mode == "mongo":
             await self._db.configs.update_one(
                 {"user_id": user_id},
-                {"$set": {"allow_chats": cfg.get("allow_chats", []),
-                          "templates": cfg.get("templates", []),
-                          "updated_at": now_ts()}},
+                {"$set": {field: value, "updated_at": now_ts()}, "$setOnInsert": {other: []}},
                 upsert=True
             )
-        else:
+            return
+        async with self._config_lock:
             await self._sqlite.execute(
+                f"INSERT INTO configs(user_id, {field}, {other}, updated_at) VALUES(?,?,?,?) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {field}=excluded.{field}, updated_at=excluded.updated_at",
+                (user_id, self.codec.encode(value), self.codec.encode([]), now_ts())
+            )
+            await self._sqlite.commit()
+
+    # ---------------- Bulk admin ----------------
+    async def extend_premium_bulk(self, user_ids: List[int], seconds: int, now: Optional[int] = None) -> Dict[int, int]:
+        """
+        প্রতিটা ইউজারের premium max(now, বর্তমান মেয়াদ) + seconds পর্যন্ত বাড়ানো, এক bulk write এ।
+        নতুন মেয়াদ {user_id: premium_until} ফেরত দেয়।
+        """
+        if not user_ids:
+            return {}
+        now = now_ts() if now is None else now
+        if self.mode == "mongo":
+            # pipeline update: বর্তমান মানের উপর ভিত্তি করে এক round-trip এ হিসাব
+            await self._db.users.bulk_write([
+                UpdateOne({"user_id": uid}, [{"$set": {
+                    "premium_until": {"$add": [{"$max": [{"$ifNull": ["$premium_until", 0]}, now]}, seconds]},
+                    "username": {"$ifNull": ["$username", ""]},
+                    "created_at": {"$ifNull": ["$created_at", 0]},
+                    "is_active": {"$ifNull": ["$is_active", True]},
+                }}], upsert=True)
+                for uid in user_ids
+            ], ordered=False)
+            cursor = self._db.users.find({"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "premium_until": 1})
+            return {d["user_id"]: int(d["premium_until"]) async for d in cursor}
+
+        await self._sqlite.executemany(
+            "INSERT INTO users(user_id, username, created_at, premium_until, is_active) VALUES(?,?,?,?,?) "
+            "ON CONFLICT(user_id) DO UPDATE SET premium_until=MAX(COALESCE(users.premium_until, 0), ?) + ?",
+            [(uid, "", 0, now + seconds, 1, now, seconds) for uid in user_ids]
+        )
+        await self._sqlite.commit()
+        marks = ",".join("?" * len(user_ids))
+        cur = await self._sqlite.execute(f"SELECT user_id, premium_until FROM users WHERE user_id IN ({marks})", tuple(user_ids))
+        return {int(r[0]): int(r[1]) for r in await cur.fetchall()}
+
+    async def export_configs(self, user_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """configs টেবিলে যাদের row আছে তাদের {user_id, allow_chats, templates}"""
+        if self.mode == "mongo":
+            q = {"user_id": {"$in": user_ids}} if user_ids is not None else {}
+            cursor = self._db.configs.find(q, {"_id": 0, "user_id": 1, "allow_chats": 1, "templates": 1}).sort("user_id", 1)
+            return [{"user_id": d["user_id"], "allow_chats": d.get("allow_chats", []), "templates": d.get("templates", [])}
+                    async for d in cursor]
+        sql = "SELECT user_id, allow_chats, templates FROM configs"
+        args: Tuple = ()
+        if user_ids is not None:
+            if not user_ids:
+                return []
+            sql += f" WHERE user_id IN ({','.join('?' * len(user_ids))})"
+            args = tuple(user_ids)
+        cur = await self._sqlite.execute(sql + " ORDER BY user_id", args)
+        return [{"user_id": r[0], "allow_chats": self.codec.decode(r[1], []), "templates": self.codec.decode(r[2], [])}
+                for r in await cur.fetchall()]
+
+    async def get_configs(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """একাধিক ইউজারের get_config এক query তে (row না থাকলে / টেমপ্লেট খালি হলে ডিফল্ট সহ)"""
+        found = {c["user_id"]: c for c in await self.export_configs(user_ids)}
+        out = {}
+        for uid in user_ids:
+            cfg = found.get(uid) or {"user_id": uid, "allow_chats": [], "templates": []}
+            if not cfg["templates"]:
+                cfg["templates"] = DEFAULT_TEMPLATES
+            out[uid] = cfg
+        return out
+
+    async def import_configs(self, configs: List[Dict[str, Any]], mode: str = "replace"):
+        """
+        {user_id, allow_chats?, templates?} গুলো এক ট্রানজ্যাকশন / bulk write এ upsert।
+        না দেওয়া (None) ফিল্ড আগের মতো থাকে। replace: দেওয়া ফিল্ড বদলে দেয়;
+        merge: allow_chats union, templates আগেরগুলোর শেষে যোগ। merge টা DB তেই হয়,
+        তাই মাঝখানে আসা /allow বা /settpl হারায় না।
+        """
+        if mode not in ("replace", "merge"):
+            raise ValueError(f"Unknown import mode {mode!r}")
+        if not configs:
+            return
+        ts = now_ts()
+        if self.mode == "mongo":
+            ops = []
+            for c in configs:
+                allow, tpls = c.get("allow_chats"), c.get("templates")
+                cur_allow = {"$ifNull": ["$allow_chats", []]}
+                cur_tpls = {"$ifNull": ["$templates", []]}
+                if allow is None:
+                    new_allow = cur_allow
+                elif mode == "merge":
+                    new_allow = {"$setUnion": [cur_allow, {"$literal": sorted(set(allow))}]}
+                else:
+                    new_allow = {"$literal": sorted(set(allow))}
+                if tpls is None:
+                    new_tpls = cur_tpls
+                elif mode == "merge":
+                    new_tpls = {"$concatArrays": [cur_tpls, {"$literal": tpls}]}
+                else:
+                    new_tpls = {"$literal": tpls}
+                # pipeline update: বর্তমান মানের উপর ভিত্তি করে এক round-trip এ হিসাব
+                ops.append(UpdateOne({"user_id": c["user_id"]}, [{"$set": {
+                    "allow_chats": new_allow, "templates": new_tpls, "updated_at": ts,
+                }}], upsert=True))
+            await self._db.configs.bulk_write(ops, ordered=False)
+            return
+
+        user_ids = [c["user_id"] for c in configs]
+        async with self._config_lock:
+            current = {c["user_id"]: c for c in await self.export_configs(user_ids)}
+            rows = []
+            for c in configs:
+                cur = current.get(c["user_id"], {"allow_chats": [], "templates": []})
+                allow, tpls = cur["allow_chats"], cur["templates"]
+                if c.get("allow_chats") is not None:
+                    new = set(c["allow_chats"])
+                    allow = sorted(set(allow) | new) if mode == "merge" else sorted(new)
+                if c.get("templates") is not None:
+                    tpls = tpls + c["templates"] if mode == "merge" else c["templates"]
+                rows.append((c["user_id"], self.codec.encode(allow), self.codec.encode(tpls), ts))
+            await self._sqlite.executemany(
                 "INSERT INTO configs(user_id, allow_chats, templates, updated_at) VALUES(?,?,?,?) "
                 "ON CONFLICT(user_id) DO UPDATE SET allow_chats=excluded.allow_chats, templates=excluded.templates, updated_at=excluded.updated_at",
-                (user_id, json.dumps(cfg.get("allow_chats", [])), json.dumps(cfg.get("templates", [])), now_ts())
+                rows
             )
             await self._sqlite.commit()
 
-    # ---------------- Logs ----------------
-    async def add_log(self, user_id: int, level: str, message: str, meta: Optional[Dict[str, Any]] = None):
-        meta_s = json.dumps(meta or {}, ensure_ascii=False)
+    async def revoke_sessions(self, user_ids: List[int]) -> int:
+        """
+        session string খালি করে দেওয়া (row মুছে নয়), যাতে Mongo change stream এ update হিসেবে
+        অন্য instance গুলোও জানতে পারে। কতগুলো session বাতিল হলো ফেরত দেয়।
+        """
+        if not user_ids:
+            return 0
         if self.mode == "mongo":
-            await self._db.logs.insert_one({"ts": now_ts(), "user_id": user_id, "level": level, "message": message, "meta": meta or {}})
-        else:
-            await self._sqlite.execute(
-                "INSERT INTO logs(ts, user_id, level, message, meta) VALUES(?,?,?,?,?)",
-                (now_ts(), user_id, level, message, meta_s)
+            res = await self._db.sessions.update_many(
+                {"user_id": {"$in": user_ids}, "session_string": {"$nin": ["", None]}},
+                {"$set": {"session_string": "", "updated_at": now_ts()}}
             )
-            await self._sqlite.commit()
+            return res.modified_count
+        marks = ",".join("?" * len(user_ids))
+        cur = await self._sqlite.execute(
+            f"UPDATE sessions SET session_string='', updated_at=? WHERE user_id IN ({marks}) AND session_string<>''",
+            (now_ts(), *user_ids)
+        )
+        await self._sqlite.commit()
+        return cur.rowcount
+
+    # ---------------- Logs ----------------
+    async def add_log(self, user_id: int, level: str, message: str, meta: Optional[Dict[str, Any]] = None):
+        entry = {"ts": now_ts(), "user_id": user_id, "level": level, "message": message, "meta": meta or {}}
+        try:
+            if self.mode == "mongo":
+                await self._db.logs.insert_one(dict(entry))
+            else:
+                await self._sqlite.execute(
+                    "INSERT INTO logs(ts, user_id, level, message, meta) VALUES(?,?,?,?,?)",
+                    (entry["ts"], user_id, level, message, self.codec.encode(entry["meta"]))
+                )
+                await self._sqlite.commit()
+        finally:
+            # DB তে লেখার পরে publish: /api/logs এর last_id এর আগের সব লগ history তেই থাকে
+            self.log_hub.publish(entry)
 
     async def list_logs(self, limit: int = 200) -> List[Dict[str, Any]]:
         limit = max(1, min(1000, int(limit)))
         if self.mode == "mongo":
-            cursor = self._db.logs.find({}, {"_id": 0}).sort("ts", -1).limit(limit)
+            # একই সেকেন্ডের লগে নতুনটা আগে (SQLite এর rowid এর মতো)
+            cursor = self._db.logs.find({}, {"_id": 0}).sort([("ts", -1), ("_id", -1)]).limit(limit)
             return [d async for d in cursor]
         cur = await self._sqlite.execute(
-            "SELECT ts, user_id, level, message, meta FROM logs ORDER BY ts DESC LIMIT ?",
+            "SELECT ts, user_id, level, message, meta FROM logs ORDER BY ts DESC, rowid DESC LIMIT ?",
             (limit,)
         )
         rows = await cur.fetchall()
         out = []
         for r in rows:
-            out.append({"ts": r[0], "user_id": r[1], "level": r[2], "message": r[3], "meta": json.loads(r[4] or "{}")})
+            out.append({"ts": r[0], "user_id": r[1], "level": r[2], "message": r[3], "meta": self.codec.decode(r[4], {})})
         return out
 
+    # ---------------- Meta ----------------
+    async def _get_meta(self, key: str) -> Optional[str]:
+        if self.mode == "mongo":
+            doc = await self._db.meta.find_one({"_id": key})
+            return doc.get("value") if doc else None
+        cur = await self._sqlite.execute("SELECT value FROM meta WHERE key=?", (key,))
+        row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def _set_meta(self, key: str, value: str):
+        if self.mode == "mongo":
+            await self._db.meta.update_one({"_id": key}, {"$set": {"value": value}}, upsert=True)
+            return
+        await self._sqlite.execute(
+            "INSERT INTO meta(key, value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            (key, value)
+        )
+        await self._sqlite.commit()
+
+    # ---------------- Codec migration ----------------
+    async def reencode_rows(self, batch: int = 500, pause: float = 0.05) -> int:
+        """
+        SQLite: configs/logs এর JSON কলামের যেসব row অন্য ফরম্যাটে (tag) আছে সেগুলো বর্তমান DB_CODEC এ লেখা।
+        json এ শুধু compressed row গুলো plain হয়, zjson এ শুধু plain row গুলো compress হয়।
+        rowid ধরে ব্যাচে চলে আর মাঝে থামে, তাই বড় টেবিলেও অন্য query আটকে থাকে না।
+        row বদলে গেলে (এর মধ্যে কেউ লিখলে) সেটা বাদ যায়। পুরো পাস শেষ হলে meta তে codec এর নাম রাখা হয়,
+        তাই codec না বদলালে পরের স্টার্টআপে আর স্ক্যান হয় না। Mongo তে কিছু করার নেই।
+        """
+        if self.mode == "mongo":
+            return 0
+        if await self._get_meta("reencoded_codec") == self.codec.name:
+            return 0
+        # অন্য ফরম্যাটের row: json এ BLOB, zjson এ TEXT
+        other = "blob" if self.codec.name == "json" else "text"
+        total = 0
+        for table, cols in (("configs", ("allow_chats", "templates")), ("logs", ("meta",))):
+            select = (f"SELECT rowid, {', '.join(cols)} FROM {table} WHERE rowid>? "
+                      f"AND ({' OR '.join(f'typeof({c})=?' for c in cols)}) ORDER BY rowid LIMIT ?")
+            update = (f"UPDATE {table} SET {', '.join(c + '=?' for c in cols)} "
+                      f"WHERE rowid=? AND {' AND '.join(c + ' IS ?' for c in cols)}")
+            last = 0
+            while True:
+                cur = await self._sqlite.execute(select, (last, *(other,) * len(cols), batch))
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                changes = []
+                for rowid, *old in rows:
+                    new = [self.codec.reencode(v) for v in old]
+                    if any(n is not None for n in new):
+                        changes.append((*(o if n is None else n for o, n in zip(old, new)), rowid, *old))
+                if changes:
+                    cur = await self._sqlite.executemany(update, changes)
+                    await self._sqlite.commit()
+                    total += len(changes)
+                await asyncio.sleep(pause)
+        await self._set_meta("reencoded_codec", self.codec.name)
+        return total
+
     # ---------------- Jobs (simple scheduler) ----------------
     async def add_job(self, job_id: str, user_id: int, chat_id: int, template_idx: int, run_at: int):
         if self.mode == "mongo":
@@ -301,3 +648,345 @@ class Database:
         else:
             await self._sqlite.execute("UPDATE jobs SET status='done' WHERE job_id=?", (job_id,))
             await self._sqlite.commit()
+
+    # ---------------- Pending debounce checkpoint ----------------
+    async def save_pending_posts(self, rows: List[Tuple[int, int, float]]):
+        """(user_id, chat_id, deadline) গুলো এক bulk write এ সেভ (shutdown এর সময়)"""
+        if not rows:
+            return
+        if self.mode == "mongo":
+            await self._db.pending_posts.bulk_write([
+                UpdateOne({"user_id": uid, "chat_id": cid}, {"$set": {"deadline": deadline}}, upsert=True)
+                for uid, cid, deadline in rows
+            ], ordered=False)
+        else:
+            await self._sqlite.executemany(
+                "INSERT OR REPLACE INTO pending_posts(user_id, chat_id, deadline) VALUES(?,?,?)", rows
+            )
+            await self._sqlite.commit()
+
+    async def pop_pending_posts(self, user_id: int) -> List[Tuple[int, float]]:
+        """এক ইউজারের সেভ করা (chat_id, deadline) পড়ে মুছে ফেলা"""
+        if self.mode == "mongo":
+            cursor = self._db.pending_posts.find({"user_id": user_id}, {"_id": 0})
+            rows = [(d["chat_id"], d["deadline"]) async for d in cursor]
+            await self._db.pending_posts.delete_many({"user_id": user_id})
+            return rows
+        cur = await self._sqlite.execute("SELECT chat_id, deadline FROM pending_posts WHERE user_id=?", (user_id,))
+        rows = await cur.fetchall()
+        await self._sqlite.execute("DELETE FROM pending_posts WHERE user_id=?", (user_id,))
+        await self._sqlite.commit()
+        return [(int(r[0]), float(r[1])) for r in rows]
+
+    async def get_pending_post_users(self) -> List[int]:
+        if self.mode == "mongo":
+            return [int(x) for x in await self._db.pending_posts.distinct("user_id")]
+        cur = await self._sqlite.execute("SELECT DISTINCT user_id FROM pending_posts")
+        rows = await cur.fetchall()
+        return [int(r[0]) for r in rows]
+
+    # ---------------- Send ledger ----------------
+    async def claim_send(self, send_key: str, user_id: int, chat_id: int) -> bool:
+        """
+        একই send_key দ্বিতীয়বার claim করা যায় না। True মানে এখন পাঠানো নিরাপদ;
+        False মানে আগেই (হয়তো crash এর আগে) পাঠানো হয়েছে বা পাঠানো চলছিল।
+        """
+        if self.mode == "mongo":
+            try:
+                await self._db.send_ledger.insert_one(
+                    {"send_key": send_key, "user_id": user_id, "chat_id": chat_id, "status": "sending", "ts": now_ts()}
+                )
+                return True
+            except DuplicateKeyError:
+                return False
+        cur = await self._sqlite.execute(
+            "INSERT OR IGNORE INTO send_ledger(send_key, user_id, chat_id, status, ts) VALUES(?,?,?,?,?)",
+            (send_key, user_id, chat_id, "sending", now_ts())
+        )
+        await self._sqlite.commit()
+        return cur.rowcount == 1
+
+    async def finish_send(self, send_key: str, status: str):
+        if self.mode == "mongo":
+            await self._db.send_ledger.update_one({"send_key": send_key}, {"$set": {"status": status}})
+        else:
+            await self._sqlite.execute("UPDATE send_ledger SET status=? WHERE send_key=?", (status, send_key))
+            await self._sqlite.commit()
+
+    async def prune_send_ledger(self, older_than: int):
+        if self.mode == "mongo":
+            await self._db.send_ledger.delete_many({"ts": {"$lt": older_than}})
+        else:
+            await self._sqlite.execute("DELETE FROM send_ledger WHERE ts<?", (older_than,))
+            await self._sqlite.commit()
+
+    # ---------------- Chat stats ----------------
+    async def add_chat_stats(self, rows: List[Tuple[int, int, int, int, int, int, int]]):
+        """(user_id, chat_id, bucket_ts, seen, resets, sends, fails) delta গুলো এক bulk write এ যোগ"""
+        if not rows:
+            return
+        if self.mode == "mongo":
+            await self._db.chat_stats.bulk_write([
+                UpdateOne({"user_id": uid, "chat_id": cid, "bucket_ts": ts},
+                          {"$inc": {"seen": seen, "resets": resets, "sends": sends, "fails": fails}}, upsert=True)
+                for uid, cid, ts, seen, resets, sends, fails in rows
+            ], ordered=False)
+        else:
+            await self._sqlite.executemany(
+                "INSERT INTO chat_stats(user_id, chat_id, bucket_ts, seen, resets, sends, fails) VALUES(?,?,?,?,?,?,?) "
+                "ON CONFLICT(user_id, chat_id, bucket_ts) DO UPDATE SET seen=seen+excluded.seen, "
+                "resets=resets+excluded.resets, sends=sends+excluded.sends, fails=fails+excluded.fails",
+                rows
+            )
+            await self._sqlite.commit()
+
+    async def get_chat_stats(self, since: int, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """since থেকে এখন পর্যন্ত (user, chat) প্রতি যোগফল"""
+        if self.mode == "mongo":
+            match: Dict[str, Any] = {"bucket_ts": {"$gte": since}}
+            if user_id is not None:
+                match["user_id"] = user_id
+            cursor = self._db.chat_stats.aggregate([
+                {"$match": match},
+                {"$group": {"_id": {"user_id": "$user_id", "chat_id": "$chat_id"},
+                            "seen": {"$sum": "$seen"}, "resets": {"$sum": "$resets"},
+                            "sends": {"$sum": "$sends"}, "fails": {"$sum": "$fails"}}},
+                {"$sort": {"_id.user_id": 1, "_id.chat_id": 1}},
+            ])
+            out = []
+            async for d in cursor:
+                key = d.pop("_id")
+                out.append({"user_id": key["user_id"], "chat_id": key["chat_id"], **d})
+            return out
+        sql = ("SELECT user_id, chat_id, SUM(seen), SUM(resets), SUM(sends), SUM(fails) "
+               "FROM chat_stats WHERE bucket_ts>=?")
+        args: Tuple = (since,)
+        if user_id is not None:
+            sql += " AND user_id=?"
+            args += (user_id,)
+        cur = await self._sqlite.execute(sql + " GROUP BY user_id, chat_id ORDER BY user_id, chat_id", args)
+        rows = await cur.fetchall()
+        return [{"user_id": r[0], "chat_id": r[1], "seen": r[2], "resets": r[3], "sends": r[4], "fails": r[5]}
+                for r in rows]
+
+    # ---------------- Broadcasts ----------------
+    _BROADCAST_FIELDS = ("broadcast_id", "text", "status", "cursor", "total", "sent", "failed", "created_at", "updated_at",
+                         "owner", "lease_until")
+
+    async def iter_user_ids(self, after: int, limit: int = 100) -> List[int]:
+        """user_id ক্রমে after এর পরের active ইউজার (cursor pagination, পুরো টেবিল মেমোরিতে আনে না)"""
+        if self.mode == "mongo":
+            cursor = self._db.users.find(
+                {"user_id": {"$gt": after}, "is_active": True}, {"_id": 0, "user_id": 1}
+            ).sort("user_id", 1).limit(limit)
+            return [d["user_id"] async for d in cursor]
+        cur = await self._sqlite.execute(
+            "SELECT user_id FROM users WHERE user_id>? AND is_active=1 ORDER BY user_id LIMIT ?",
+            (after, limit)
+        )
+        rows = await cur.fetchall()
+        return [int(r[0]) for r in rows]
+
+    async def count_active_users(self) -> int:
+        if self.mode == "mongo":
+            return await self._db.users.count_documents({"is_active": True})
+        cur = await self._sqlite.execute("SELECT COUNT(*) FROM users WHERE is_active=1")
+        row = await cur.fetchone()
+        return int(row[0])
+
+    async def create_broadcast(self, broadcast_id: str, text: str, total: int):
+        doc = {"broadcast_id": broadcast_id, "text": text, "status": "running", "cursor": 0,
+               "total": total, "sent": 0, "failed": 0, "created_at": now_ts(), "updated_at": now_ts(),
+               "owner": None, "lease_until": 0}
+        if self.mode == "mongo":
+            await self._db.broadcasts.insert_one(doc)
+        else:
+            await self._sqlite.execute(
+                f"INSERT INTO broadcasts({', '.join(self._BROADCAST_FIELDS)}) "
+                f"VALUES({','.join('?' * len(self._BROADCAST_FIELDS))})",
+                tuple(doc[k] for k in self._BROADCAST_FIELDS)
+            )
+            await self._sqlite.commit()
+
+    async def get_broadcast(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        if self.mode == "mongo":
+            return await self._db.broadcasts.find_one({"broadcast_id": broadcast_id}, {"_id": 0})
+        cur = await self._sqlite.execute(
+            f"SELECT {', '.join(self._BROADCAST_FIELDS)} FROM broadcasts WHERE broadcast_id=?", (broadcast_id,)
+        )
+        row = await cur.fetchone()
+        return dict(zip(self._BROADCAST_FIELDS, row)) if row else None
+
+    async def list_broadcasts(self, status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        if self.mode == "mongo":
+            q = {"status": status} if status else {}
+            cursor = self._db.broadcasts.find(q, {"_id": 0}).sort("created_at", -1).limit(limit)
+            return [d async for d in cursor]
+        sql = f"SELECT {', '.join(self._BROADCAST_FIELDS)} FROM broadcasts"
+        args: Tuple = ()
+        if status:
+            sql += " WHERE status=?"
+            args = (status,)
+        cur = await self._sqlite.execute(sql + " ORDER BY created_at DESC LIMIT ?", args + (limit,))
+        rows = await cur.fetchall()
+        return [dict(zip(self._BROADCAST_FIELDS, r)) for r in rows]
+
+    async def set_broadcast_status(self, broadcast_id: str, status: str):
+        if self.mode == "mongo":
+            await self._db.broadcasts.update_one(
+                {"broadcast_id": broadcast_id}, {"$set": {"status": status, "updated_at": now_ts()}}
+            )
+        else:
+            await self._sqlite.execute(
+                "UPDATE broadcasts SET status=?, updated_at=? WHERE broadcast_id=?", (status, now_ts(), broadcast_id)
+            )
+            await self._sqlite.commit()
+
+    async def claim_broadcast(self, broadcast_id: str, owner: str, lease_seconds: int,
+                              now: Optional[int] = None) -> bool:
+        """
+        running broadcast এর lease নেওয়া বা নবায়ন (atomic)। owner নেই, নিজেরই, বা আগের lease শেষ হলে তবেই পাওয়া যায়,
+        তাই একই DB শেয়ার করা একাধিক instance এর মধ্যে একটা broadcast একসময়ে একজনই চালায়।
+        """
+        now = now_ts() if now is None else now
+        if self.mode == "mongo":
+            res = await self._db.broadcasts.update_one(
+                {"broadcast_id": broadcast_id, "status": "running",
+                 "$or": [{"owner": None}, {"owner": owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": owner, "lease_until": now + lease_seconds}}
+            )
+            return res.matched_count > 0
+        cur = await self._sqlite.execute(
+            "UPDATE broadcasts SET owner=?, lease_until=? WHERE broadcast_id=? AND status='running' "
+            "AND (owner IS NULL OR owner=? OR lease_until<?)",
+            (owner, now + lease_seconds, broadcast_id, owner, now)
+        )
+        await self._sqlite.commit()
+        return cur.rowcount > 0
+
+    async def release_broadcast(self, broadcast_id: str, owner: str):
+        """নিজের lease ছেড়ে দেওয়া, যাতে অন্য instance সাথে সাথে নিতে পারে"""
+        if self.mode == "mongo":
+            await self._db.broadcasts.update_one(
+                {"broadcast_id": broadcast_id, "owner": owner}, {"$set": {"owner": None, "lease_until": 0}}
+            )
+        else:
+            await self._sqlite.execute(
+                "UPDATE broadcasts SET owner=NULL, lease_until=0 WHERE broadcast_id=? AND owner=?", (broadcast_id, owner)
+            )
+            await self._sqlite.commit()
+
+    async def get_broadcast_recipients_done(self, broadcast_id: str, user_ids: List[int]) -> List[int]:
+        """এই user_id গুলোর মধ্যে যাদের স্ট্যাটাস আগেই লেখা আছে (resume এ ডুপ্লিকেট এড়াতে)"""
+        if not user_ids:
+            return []
+        if self.mode == "mongo":
+            cursor = self._db.broadcast_recipients.find(
+                {"broadcast_id": broadcast_id, "user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1}
+            )
+            return [d["user_id"] async for d in cursor]
+        marks = ",".join("?" * len(user_ids))
+        cur = await self._sqlite.execute(
+            f"SELECT user_id FROM broadcast_recipients WHERE broadcast_id=? AND user_id IN ({marks})",
+            (broadcast_id, *user_ids)
+        )
+        rows = await cur.fetchall()
+        return [int(r[0]) for r in rows]
+
+    async def record_broadcast_batch(self, broadcast_id: str, cursor: int,
+                                     results: List[Tuple[int, str, Optional[str]]]):
+        """
+        একটা ব্যাচের (user_id, status, error) আর নতুন cursor একসাথে লেখা।
+        SQLite এ এক ট্রানজ্যাকশন; Mongo তে আগে recipients তারপর cursor, তাই মাঝপথে
+        crash হলেও resume এর সময় get_broadcast_recipients_done দিয়ে ডুপ্লিকেট বাদ যায়।
+        """
+        ts = now_ts()
+        sent = sum(1 for _, st, _ in results if st == "sent")
+        failed = len(results) - sent
+        if self.mode == "mongo":
+            if results:
+                await self._db.broadcast_recipients.bulk_write([
+                    UpdateOne({"broadcast_id": broadcast_id, "user_id": uid},
+                              {"$set": {"status": st, "error": err, "ts": ts}}, upsert=True)
+                    for uid, st, err in results
+                ], ordered=False)
+            await self._db.broadcasts.update_one(
+                {"broadcast_id": broadcast_id},
+                {"$set": {"cursor": cursor, "updated_at": ts}, "$inc": {"sent": sent, "failed": failed}}
+            )
+        else:
+            await self._sqlite.executemany(
+                "INSERT OR REPLACE INTO broadcast_recipients(broadcast_id, user_id, status, error, ts) VALUES(?,?,?,?,?)",
+                [(broadcast_id, uid, st, err, ts) for uid, st, err in results]
+            )
+            await self._sqlite.execute(
+                "UPDATE broadcasts SET cursor=?, sent=sent+?, failed=failed+?, updated_at=? WHERE broadcast_id=?",
+                (cursor, sent, failed, ts, broadcast_id)
+            )
+            await self._sqlite.commit()
+
+    # ---------------- Change streams (Mongo only) ----------------
+    WATCHED_COLLECTIONS = ("configs", "users", "sessions")
+
+    async def watch_changes(self, on_change: Callable[[str, Optional[Dict[str, Any]]], Awaitable[None]],
+                            stop: asyncio.Event):
+        """
+        configs/users/sessions এর change stream শুনে on_change(coll, doc) কল করে।
+        একাধিক instance একই Mongo শেয়ার করলে এক instance এর পরিবর্তন বাকিরা এখান থেকে পায়।
+        Resume token শুধু এই প্রসেসের মেমোরিতে থাকে (instance গুলো একে অন্যের token এ resume করে
+        নিজের না-দেখা পরিবর্তন বাদ দেবে না); disconnect এর পর সেখান থেকেই আবার শুরু হয়।
+        নতুন প্রসেসে resume এর দরকার নেই, কারণ ক্যাশ খালি থেকে শুরু হয়।
+        token হারিয়ে গেলে বা নতুন করে stream খুললে on_change("resync", None) দিয়ে full reload চাওয়া হয়।
+        stream চালু থাকলে change_stream_live True; ক্যাশ তখন TTL ছাড়াই রাখা যায়।
+        Change stream এর জন্য replica set লাগে (লোকালি single-node replica set যথেষ্ট)।
+        SQLite মোডে কিছুই করে না।
+        """
+        if self.mode != "mongo" or not settings.CHANGE_STREAMS:
+            return
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(self.WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }}]
+        backoff = 1
+        token = None
+        try:
+            while not stop.is_set():
+                try:
+                    async with self._db.watch(pipeline, full_document="updateLookup", resume_after=token) as stream:
+                        backoff = 1
+                        if token is None:
+                            # resume ছাড়া খোলা: এর আগের TTL ক্যাশ stale হতে পারে
+                            self.change_stream_live = True
+                            await on_change("resync", None)
+                        while not stop.is_set():
+                            change = await stream.try_next()
+                            if change is None:
+                                # কোন পরিবর্তন নেই; idle অবস্থাতেও token এগিয়ে রাখা
+                                if stream.resume_token is not None:
+                                    token = stream.resume_token
+                                await asyncio.sleep(0.5)
+                                continue
+                            doc = change.get("fullDocument")
+                            if doc is not None:
+                                doc.pop("_id", None)
+                                try:
+                                    await on_change(change["ns"]["coll"], doc)
+                                except Exception as e:
+                                    await self.add_log(0, "ERROR", f"Change handler failed: {e}")
+                            token = change["_id"]
+                except OperationFailure as e:
+                    if e.code == 40573:
+                        # standalone server: change stream সাপোর্ট নেই
+                        await self.add_log(0, "WARN", "Change streams unavailable (MongoDB is not a replica set)")
+                        return
+                    if e.code in (260, 280, 286):
+                        # resume token আর oplog এ নেই: নতুন করে শুরু (খোলার সময় resync হবে)
+                        token = None
+                        continue
+                    await self.add_log(0, "ERROR", f"Change stream failed: {e}")
+                except PyMongoError as e:
+                    await self.add_log(0, "ERROR", f"Change stream disconnected: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+        finally:
+            self.change_stream_live = False
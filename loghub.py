@@ -0,0 +1,68 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+
+
+class LogSubscriber:
+    def __init__(self, user_id: Optional[int], levels: Optional[Set[str]], buffer: int):
+        self.user_id = user_id
+        self.levels = levels
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+        # বাফার ভরে গেলে (slow consumer) hub থেকে বাদ; ক্লায়েন্ট last_id দিয়ে আবার আসবে
+        self.evicted = False
+
+    def matches(self, entry: Dict[str, Any]) -> bool:
+        if self.user_id is not None and entry.get("user_id") != self.user_id:
+            return False
+        if self.levels and entry.get("level") not in self.levels:
+            return False
+        return True
+
+
+class LogHub:
+    """
+    In-process log fan-out. add_log এর প্রতিটা এন্ট্রি ক্রমিক id সহ ring buffer এ রাখা হয়
+    আর প্রতিটা subscriber এর নিজস্ব bounded queue তে যায়। DB তে কোনো query হয় না।
+    """
+
+    def __init__(self, size: int = 1000, subscriber_buffer: int = 256):
+        self.ring: deque = deque(maxlen=size)
+        self.subscriber_buffer = subscriber_buffer
+        self.subscribers: Set[LogSubscriber] = set()
+        self.last_id = 0
+        self.evictions = 0
+
+    def publish(self, entry: Dict[str, Any]) -> int:
+        self.last_id += 1
+        entry = dict(entry, id=self.last_id)
+        self.ring.append(entry)
+        for sub in list(self.subscribers):
+            if not sub.matches(entry):
+                continue
+            try:
+                sub.queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                sub.evicted = True
+                self.subscribers.discard(sub)
+                self.evictions += 1
+        return self.last_id
+
+    def subscribe(self, user_id: Optional[int] = None, levels: Optional[Set[str]] = None,
+                  last_id: Optional[int] = None) -> LogSubscriber:
+        sub = LogSubscriber(user_id, levels, self.subscriber_buffer)
+        if last_id is not None:
+            # ring এ যা আছে তার থেকে resume (বাফারের চেয়ে বেশি হলে শেষেরগুলো)
+            backlog = [e for e in self.ring if e["id"] > last_id and sub.matches(e)]
+            for e in backlog[-self.subscriber_buffer:]:
+                sub.queue.put_nowait(e)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: LogSubscriber):
+        self.subscribers.discard(sub)
+
+    def since(self, last_id: int) -> List[Dict[str, Any]]:
+        return [e for e in self.ring if e["id"] > last_id]
+
+    def recent(self, limit: int = 200) -> List[Dict[str, Any]]:
+        return list(self.ring)[-limit:]
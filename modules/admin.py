@@ -23,3 +23,25 @@ def parse_approve(text: str):
 
 def approved_text(user_id: int, until: int) -> str:
     return f"✅ Approved user `{user_id}` until `{time.strftime('%Y-%m-%d %H:%M', time.localtime(until))}`"
+
+
+def broadcast_status_text(b: dict) -> str:
+    eta = b.get("eta")
+    eta_s = f"{int(eta // 60)}m {int(eta % 60)}s" if eta is not None else "N/A"
+    return (
+        f"📣 Broadcast `{b['broadcast_id']}`: **{b['status']}**\n"
+        f"• Progress: {b['done']}/{b['total']} (sent {b['sent']}, failed {b['failed']})\n"
+        f"• Throughput: {b['rate']:.1f} msg/s\n"
+        f"• ETA: {eta_s}"
+    )
+
+
+def rate_stats_text(metrics: dict, admission, reconcile: dict) -> str:
+    lines = ["🚦 **Rate limit stats**"]
+    for kind in ("allowed", "limited", "busy"):
+        counts = metrics.get(kind, {})
+        detail = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "0"
+        lines.append(f"• {kind}: {detail}")
+    lines.append(f"• admission: {admission.running} running, {admission.waiting} waiting")
+    lines.append(f"• reconciler: {reconcile.get('starts', 0)} starts, {reconcile.get('restarts', 0)} restarts")
+    return "\n".join(lines)
@@ -4,7 +4,9 @@ def help_text() -> str:
         "1) Allowlist chat add:\n"
         "• `/allow -100xxxxxxxxxx`\n\n"
         "2) Post template now (premium required):\n"
-        "• `/post -100xxxxxxxxxx 0`\n\n"
+        "• `/post -100xxxxxxxxxx 0`\n"
+        "• `/post all 0` (allowlist এর সব চ্যাটে)\n"
+        "• `/post all 0 -100aaa -100bbb` (নির্দিষ্ট কয়েকটায়)\n\n"
         "3) Schedule post after seconds (premium required):\n"
         "• `/schedule -100xxxxxxxxxx 0 3600`\n\n"
         "4) Set templates (simple):\n"
@@ -13,3 +15,36 @@ def help_text() -> str:
         "5) Show allowlist:\n"
         "• `/allowlist`"
     )
+
+
+# Telegram মেসেজ সীমা 4096; markdown/ইমোজির জন্য কিছু জায়গা রেখে
+FANOUT_TEXT_LIMIT = 3500
+FANOUT_CHATS_PER_ERROR = 5
+
+
+def fanout_result_text(res: dict) -> str:
+    if res.get("error"):
+        return f"❌ Fan-out failed: {res['error']}"
+    text = f"📤 **Fan-out result**: {res['sent']} sent, {res['failed']} failed ({res['elapsed']:.1f}s)"
+
+    # ব্যর্থ চ্যাটগুলো error অনুযায়ী গ্রুপ করে (চ্যাট প্রতি এক লাইন দিলে শ'খানেক চ্যাটে সীমা ছাড়িয়ে যায়)
+    groups = {}
+    for chat_id, err in res.get("results", []):
+        if err is not None:
+            groups.setdefault(str(err)[:120], []).append(chat_id)
+    if not groups:
+        return text
+
+    lines = [text, ""]
+    size = len(text) + 1
+    ordered = sorted(groups.items(), key=lambda kv: -len(kv[1]))
+    for i, (err, chats) in enumerate(ordered):
+        shown = ", ".join(f"`{c}`" for c in chats[:FANOUT_CHATS_PER_ERROR])
+        more = f" +{len(chats) - FANOUT_CHATS_PER_ERROR}" if len(chats) > FANOUT_CHATS_PER_ERROR else ""
+        line = f"❌ {err} ({len(chats)}): {shown}{more}"
+        if size + len(line) + 1 > FANOUT_TEXT_LIMIT:
+            lines.append(f"… আরও {len(ordered) - i} ধরনের error")
+            break
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
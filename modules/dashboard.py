@@ -5,14 +5,22 @@ def fmt_ts(ts: int) -> str:
         return "N/A"
     return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
 
-def dashboard_text(user_id: int, username: str, premium_ok: bool, premium_until: int, has_session: bool, allow_count: int) -> str:
+def dashboard_text(user_id: int, username: str, premium_ok: bool, premium_until: int, has_session: bool, allow_count: int,
+                   stats: dict = None) -> str:
+    activity = ""
+    if stats:
+        activity = (
+            f"• Last 24h: {stats['seen']} msgs seen, {stats['resets']} timer resets, "
+            f"{stats['sends']} posts, {stats['fails']} failed\n"
+        )
     return (
         "📊 **Your Dashboard**\n\n"
         f"• User: `{user_id}` @{username}\n"
         f"• Session: {'✅ Connected' if has_session else '❌ Not connected'}\n"
         f"• Allowlist chats: **{allow_count}**\n"
         f"• Premium: {'✅ Active' if premium_ok else '❌ Inactive'}\n"
-        f"• Premium Until: **{fmt_ts(premium_until)}**\n\n"
+        f"• Premium Until: **{fmt_ts(premium_until)}**\n"
+        f"{activity}\n"
         "Commands:\n"
         "• /allow -100xxxxxx (add allow chat)\n"
         "• /post -100xxxxxx 0 (post template idx)\n"
@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class TokenBucket:
+    """
+    সাধারণ token bucket: প্রতি সেকেন্ডে `rate` টোকেন জমে, সর্বোচ্চ `capacity` পর্যন্ত।
+    FloodWait পেলে pause_for() দিয়ে পুরো bucket থামিয়ে রাখা যায়।
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    async def acquire(self, cost: float = 1.0):
+        # lock থাকায় অপেক্ষমাণরা FIFO ক্রমে টোকেন পায়
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def pause_for(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class KeyedLimiter:
+    """key (যেমন user_id) প্রতি আলাদা TokenBucket। বেশি key হলে পুরনোগুলো বাদ (idle bucket তো ভরাই থাকে)।"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+
+    def try_acquire(self, key: Any, cost: float = 1.0) -> bool:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.try_acquire(cost)
+
+
+class AdmissionGate:
+    """
+    দামি কাজের (userbot restart / MTProto connect) global সীমা: একসাথে max_running টা চলে,
+    max_waiting এর বেশি লাইনে দাঁড়ালে নতুনগুলো সরাসরি ফিরিয়ে দেওয়া হয়।
+    """
+
+    def __init__(self, max_running: int, max_waiting: int):
+        self._sem = asyncio.Semaphore(max_running)
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.running = 0
+
+    def full(self) -> bool:
+        return self.waiting >= self.max_waiting
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.running -= 1
+        self._sem.release()
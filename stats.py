@@ -0,0 +1,106 @@
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+# কাউন্টারের ক্রম (array তে offset)
+FIELDS = ("seen", "resets", "sends", "fails")
+SEEN, RESETS, SENDS, FAILS = range(4)
+
+
+class ChatCounters:
+    """
+    এক (user, chat) এর fixed-size ring: n টা time bucket, প্রতিটাতে 4টা counter।
+    dict/object এর বদলে array ব্যবহার, তাই হাজার চ্যাটেও মেমোরি ছোট থাকে।
+    """
+
+    __slots__ = ("epochs", "counts")
+
+    def __init__(self, n: int):
+        self.epochs = array("q", [0]) * n
+        self.counts = array("L", [0]) * (n * len(FIELDS))
+
+    def incr(self, field: int, epoch: int):
+        n = len(self.epochs)
+        slot = epoch % n
+        if self.epochs[slot] != epoch:
+            # পুরনো bucket: নতুন epoch এর জন্য শূন্য করে নেওয়া
+            self.epochs[slot] = epoch
+            base = slot * len(FIELDS)
+            for i in range(len(FIELDS)):
+                self.counts[base + i] = 0
+        self.counts[slot * len(FIELDS) + field] += 1
+
+    def totals(self, since_epoch: int) -> List[int]:
+        out = [0] * len(FIELDS)
+        for slot, epoch in enumerate(self.epochs):
+            if epoch >= since_epoch:
+                base = slot * len(FIELDS)
+                for i in range(len(FIELDS)):
+                    out[i] += self.counts[base + i]
+        return out
+
+
+class ChatStats:
+    """
+    incoming_handler / সেন্ড পাথ থেকে per-(user, chat) counter।
+    লাইভ উইন্ডো (শেষ buckets × bucket_seconds) মেমোরির ring থেকে, আর
+    পুরনো হিসাব flush হয়ে chat_stats টেবিলে ঘণ্টা ভিত্তিক জমা হয়।
+    """
+
+    def __init__(self, buckets: int = 60, bucket_seconds: int = 60, flush_bucket_seconds: int = 3600):
+        self.buckets = buckets
+        self.bucket_seconds = bucket_seconds
+        self.flush_bucket_seconds = flush_bucket_seconds
+        self.counters: Dict[Tuple[int, int], ChatCounters] = {}
+        # এখনো DB তে না যাওয়া delta: {(user_id, chat_id, hour_ts): [seen, resets, sends, fails]}
+        self.pending: Dict[Tuple[int, int, int], List[int]] = {}
+
+    def incr(self, user_id: int, chat_id: int, field: int):
+        now = int(time.time())
+        key = (user_id, chat_id)
+        c = self.counters.get(key)
+        if c is None:
+            c = self.counters[key] = ChatCounters(self.buckets)
+        c.incr(field, now // self.bucket_seconds)
+
+        hour = now - now % self.flush_bucket_seconds
+        delta = self.pending.get((user_id, chat_id, hour))
+        if delta is None:
+            delta = self.pending[(user_id, chat_id, hour)] = [0] * len(FIELDS)
+        delta[field] += 1
+
+    def take_pending(self) -> List[Tuple[int, int, int, int, int, int, int]]:
+        """flush এর জন্য জমা delta বের করে খালি করা: (user_id, chat_id, bucket_ts, seen, resets, sends, fails)"""
+        rows = [(uid, cid, ts, *d) for (uid, cid, ts), d in self.pending.items()]
+        self.pending = {}
+        return rows
+
+    def restore_pending(self, rows: List[Tuple[int, int, int, int, int, int, int]]):
+        """flush ফেল করলে delta ফেরত রাখা, যাতে পরের বার আবার চেষ্টা হয়"""
+        for uid, cid, ts, *d in rows:
+            cur = self.pending.setdefault((uid, cid, ts), [0] * len(FIELDS))
+            for i, v in enumerate(d):
+                cur[i] += v
+
+    def live(self, user_id: Optional[int] = None) -> List[Dict[str, int]]:
+        since = int(time.time()) // self.bucket_seconds - self.buckets + 1
+        out = []
+        for (uid, cid), c in self.counters.items():
+            if user_id is not None and uid != user_id:
+                continue
+            row = {"user_id": uid, "chat_id": cid}
+            row.update(zip(FIELDS, c.totals(since)))
+            out.append(row)
+        return out
+
+    def unflushed(self, user_id: int) -> Dict[str, int]:
+        out = dict.fromkeys(FIELDS, 0)
+        for (uid, _, _), d in self.pending.items():
+            if uid == user_id:
+                for name, v in zip(FIELDS, d):
+                    out[name] += v
+        return out
+
+    def drop_user(self, user_id: int, keep_chats: Optional[set] = None):
+        for key in [k for k in self.counters if k[0] == user_id and (keep_chats is None or k[1] not in keep_chats)]:
+            del self.counters[key]
@@ -1,15 +1,34 @@
 import asyncio
 import random
 import os
+import time
 import logging
+from dataclasses import dataclass, asdict
 from typing import Dict, Optional, List
 
 from pyrogram import Client, filters
 from pyrogram.handlers import MessageHandler
-from pyrogram.errors import FloodWait, ChatWriteForbidden
+from pyrogram.errors import FloodWait, ChatWriteForbidden, Unauthorized
+from pyrogram.raw.functions import Ping
 
 from config import settings
-from database import Database
+from database import Database, now_ts
+from ratelimit import AdmissionGate
+from stats import ChatStats, SEEN, RESETS, SENDS, FAILS
+
+
+@dataclass
+class ClientHealth:
+    # connecting -> healthy <-> degraded -> dead -> backoff -> connecting ...
+    # revoked: session বাতিল (AUTH_KEY_UNREGISTERED ইত্যাদি), নতুন /connect ছাড়া আর চেষ্টা হবে না
+    state: str = "connecting"
+    failures: int = 0
+    next_probe: float = 0.0
+    next_attempt: float = 0.0
+    last_ok: int = 0
+    last_error: str = ""
+    revoked_session: str = ""
+
 
 class UserbotManager:
     def __init__(self, db: Database):
@@ -17,95 +36,498 @@ class UserbotManager:
         self.clients: Dict[int, Client] = {}
         # মনিটরিং টাস্ক স্টোর: {user_id: {chat_id: task}}
         self.monitor_tasks: Dict[int, Dict[int, asyncio.Task]] = {}
-        
-        self._lock = asyncio.Lock()
+        # প্রতিটা pending টাস্ক কখন ফায়ার করবে (wall clock): {user_id: {chat_id: deadline}}
+        # shutdown এ এটাই DB তে সেভ হয়, restart এর পর আবার শিডিউল হয়
+        self.pending_deadlines: Dict[int, Dict[int, float]] = {}
+
+        # ক্যাশ: প্রতিটা সেন্ডে DB থেকে config/premium না এনে এখানে রাখা হয়।
+        # পরিবর্তন হলে refresh_user / invalidate_premium (বা Mongo change stream) আপডেট করে।
+        self.configs: Dict[int, Dict] = {}
+        self.premium_until: Dict[int, int] = {}
+        # কখন লোড হয়েছে (monotonic); change stream না চললে CACHE_TTL পরে DB থেকে আবার আনা হয়
+        self._config_at: Dict[int, float] = {}
+        self._premium_at: Dict[int, float] = {}
+        # ইউজার প্রতি chat filter (runtime এ add/remove করা যায়, restart লাগে না)
+        self.chat_filters: Dict[int, filters.Filter] = {}
+        # কোন session string দিয়ে ক্লায়েন্ট চালু হয়েছে
+        self.session_strings: Dict[int, str] = {}
+        # অ্যাকাউন্ট প্রতি একসাথে কতগুলো সেন্ড চলবে
+        self._send_sems: Dict[int, asyncio.Semaphore] = {}
+        # supervisor: ক্লায়েন্ট প্রতি health state machine
+        self.health: Dict[int, ClientHealth] = {}
+        self._supervisor_task: Optional[asyncio.Task] = None
+        # per-(user, chat) activity counter, পর্যায়ক্রমে chat_stats টেবিলে flush
+        self.stats = ChatStats(settings.STATS_BUCKETS, settings.STATS_BUCKET_SECONDS)
+        self._stats_task: Optional[asyncio.Task] = None
+        self._restore_task: Optional[asyncio.Task] = None
+
+        # ইউজার প্রতি lock: একজনের connect/restart অন্যদের ensure_client আটকায় না
+        self._locks: Dict[int, asyncio.Lock] = {}
         self._stop = asyncio.Event()
+        self._watch_task: Optional[asyncio.Task] = None
+        # reconciler: {user_id: "config" | "session"}, উইন্ডো শেষে একসাথে প্রয়োগ
+        self._dirty: Dict[int, str] = {}
+        self._dirty_event = asyncio.Event()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self.reconcile_metrics = {"marks": 0, "rounds": 0, "reloads": 0, "starts": 0, "restarts": 0}
+        # MTProto connect/restart এর global সীমা: বটের /connect, reconciler আর restore সবাই এটা দিয়ে যায়
+        self.admission = AdmissionGate(settings.ADMISSION_MAX_RUNNING, settings.ADMISSION_MAX_WAITING)
 
         # main (6).py এর কনফিগারেশন
         self.IGNORED_BOTS = ['MissRose_bot', 'GroupHelpBot'] 
         self.DEFAULT_IMAGE = 'gmail.jpg' 
 
     async def start(self):
-        pass # দরকার হলে ব্যাকগ্রাউন্ড জব লুপ এখানে দিতে পারো
+        # অন্য instance থেকে আসা config/premium/session পরিবর্তন শোনা (শুধু Mongo)
+        self._watch_task = asyncio.create_task(self.db.watch_changes(self.apply_db_change, self._stop))
+        self._supervisor_task = asyncio.create_task(self._supervise())
+        self._stats_task = asyncio.create_task(self._flush_stats_loop())
+        self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+        await self.prune_send_ledger()
+        # আগের deploy এ যাদের pending পোস্ট ছিল, তাদের ক্লায়েন্ট চালু করলেই টাইমার ফিরে আসবে
+        self._restore_task = asyncio.create_task(self._restore_pending(await self.db.get_pending_post_users()))
+
+    async def _restore_pending(self, user_ids: List[int]):
+        sem = asyncio.Semaphore(settings.RECONCILE_CONCURRENCY)
+
+        async def _one(uid: int):
+            async with sem, self.admission:
+                if self._stop.is_set():
+                    return
+                try:
+                    await self.ensure_client(uid)
+                except Exception as e:
+                    await self.db.add_log(uid, "ERROR", f"Restore failed: {e}")
+
+        await asyncio.gather(*(_one(uid) for uid in user_ids))
 
     async def stop(self):
         self._stop.set()
-        async with self._lock:
-            # সব টাস্ক ক্যানসেল
-            for uid_tasks in self.monitor_tasks.values():
-                for task in uid_tasks.values():
-                    task.cancel()
-            self.monitor_tasks.clear()
-
-            # সব ক্লায়েন্ট স্টপ
-            for c in self.clients.values():
-                try:
-                    await c.stop()
-                except Exception:
-                    pass
-            self.clients.clear()
+        for t in (self._watch_task, self._supervisor_task, self._stats_task, self._reconcile_task, self._restore_task):
+            if t:
+                t.cancel()
+        await self.flush_stats()
+        # _stop সেট হওয়ার পর নতুন ensure_client আর ক্লায়েন্ট চালু করে না
+        # graceful drain: চলমান debounce টাইমারগুলো এক bulk write এ সেভ, পরের স্টার্টে restore
+        rows = [
+            (uid, chat_id, deadline)
+            for uid, chats in self.pending_deadlines.items()
+            for chat_id, deadline in chats.items()
+        ]
+        try:
+            await self.db.save_pending_posts(rows)
+        except Exception:
+            pass
+        self.pending_deadlines.clear()
+
+        # সব টাস্ক ক্যানসেল
+        for uid_tasks in self.monitor_tasks.values():
+            for task in uid_tasks.values():
+                task.cancel()
+        self.monitor_tasks.clear()
+
+        # সব ক্লায়েন্ট স্টপ
+        for c in list(self.clients.values()):
+            try:
+                await c.stop()
+            except Exception:
+                pass
+        self.clients.clear()
+        self.chat_filters.clear()
+        self.session_strings.clear()
+
+    def _user_lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    # --- Config / premium cache ---
+    def _cache_fresh(self, loaded_at: Optional[float]) -> bool:
+        if loaded_at is None:
+            return False
+        # change stream চললে অন্য instance এর পরিবর্তন সেখান থেকেই আসে; না চললে (CHANGE_STREAMS=0,
+        # standalone Mongo, SQLite) অন্য instance এর /approve, /settpl ধরতে ছোট TTL
+        return self.db.change_stream_live or time.monotonic() - loaded_at < settings.CACHE_TTL
+
+    async def get_config(self, user_id: int) -> Dict:
+        cfg = self.configs.get(user_id)
+        if cfg is None or not self._cache_fresh(self._config_at.get(user_id)):
+            cfg = await self.db.get_config(user_id)
+            # চলমান ক্লায়েন্ট থাকলে filter ও মিলিয়ে নেওয়া
+            await self.refresh_user(user_id, cfg)
+        return cfg
+
+    async def is_premium(self, user_id: int) -> bool:
+        until = self.premium_until.get(user_id)
+        if until is None or not self._cache_fresh(self._premium_at.get(user_id)):
+            _, until = await self.db.is_premium_active(user_id)
+            self.premium_until[user_id] = until
+            self._premium_at[user_id] = time.monotonic()
+        return until > now_ts()
+
+    def invalidate_premium(self, user_id: int):
+        self.premium_until.pop(user_id, None)
+
+    async def refresh_user(self, user_id: int, cfg: Optional[Dict] = None):
+        """DB থেকে config আবার লোড করে চলমান ক্লায়েন্টের chat filter জায়গায় বসেই আপডেট করে।"""
+        if cfg is None:
+            cfg = await self.db.get_config(user_id)
+        self.configs[user_id] = cfg
+        self._config_at[user_id] = time.monotonic()
+
+        flt = self.chat_filters.get(user_id)
+        if flt is None:
+            return
+        targets = {int(x) for x in cfg.get("allow_chats", [])}
+        if flt == targets:
+            return  # শুধু টেমপ্লেট বদলেছে, ক্যাশ আপডেটই যথেষ্ট
+        flt.clear()
+        flt.update(targets)
+        # allowlist থেকে বাদ পড়া চ্যাটের pending টাস্ক বাতিল
+        for chat_id, task in list(self.monitor_tasks.get(user_id, {}).items()):
+            if chat_id not in targets:
+                task.cancel()
+        self.stats.drop_user(user_id, keep_chats=targets)
+
+    async def apply_bulk_changes(self, config_users: List[int] = (), premium_users: List[int] = (),
+                                 revoked_users: List[int] = ()):
+        """
+        bulk admin API এর পর প্রয়োগ: premium ক্যাশ বাদ, session বাতিল হলে ক্লায়েন্ট এখনই বন্ধ,
+        আর config পরিবর্তন reconciler এ যায় (এক query তে লোড, filter in-place)।
+        """
+        for uid in premium_users:
+            self.invalidate_premium(uid)
+
+        for uid in revoked_users:
+            if uid in self.clients:
+                async with self._user_lock(uid):
+                    await self._detach_client(uid, checkpoint=False)
+            self.health.pop(uid, None)
+            self._dirty.pop(uid, None)
+
+        for uid in config_users:
+            self.mark_dirty(uid, "config")
+
+    async def apply_db_change(self, coll: str, doc: Optional[Dict]):
+        """Database.watch_changes থেকে আসা পরিবর্তন ক্যাশ/ক্লায়েন্টে প্রয়োগ।"""
+        if coll == "resync":
+            self.premium_until.clear()
+            for uid in list(self.configs):
+                self.mark_dirty(uid, "config")
+            return
+
+        user_id = doc.get("user_id") if doc else None
+        if user_id is None:
+            return
+        user_id = int(user_id)
+
+        if coll == "configs":
+            self.mark_dirty(user_id, "config")
+        elif coll == "users":
+            self.premium_until[user_id] = int(doc.get("premium_until") or 0)
+            self._premium_at[user_id] = time.monotonic()
+        elif coll == "sessions":
+            # session বদলালে (অন্য instance এ /connect) নতুন session দিয়ে রিস্টার্ট
+            old = self.session_strings.get(user_id)
+            if old is not None and old != doc.get("session_string"):
+                self.mark_dirty(user_id, "session")
+
+    async def _detach_client(self, user_id: int, checkpoint: bool = True):
+        """
+        ক্লায়েন্ট থামিয়ে টাস্ক বাতিল করে। pending debounce টাইমারগুলো DB তে checkpoint হয়,
+        তাই পরের ensure_client নতুন ক্লায়েন্টে সেগুলো আবার শিডিউল করে।
+        ইউজারের lock (_user_lock) ধরে রেখে কল করতে হবে।
+        """
+        pending = self.pending_deadlines.pop(user_id, {})
+        if pending and checkpoint:
+            await self.db.save_pending_posts([(user_id, cid, dl) for cid, dl in pending.items()])
+
+        if user_id in self.monitor_tasks:
+            for t in self.monitor_tasks[user_id].values():
+                t.cancel()
+            del self.monitor_tasks[user_id]
 
-    # --- নতুন মেথড: কনফিগ চেঞ্জ হলে রিস্টার্ট করার জন্য ---
+        app = self.clients.pop(user_id, None)
+        if app is not None:
+            try:
+                await app.stop()
+            except Exception:
+                pass
+        self.chat_filters.pop(user_id, None)
+        self.session_strings.pop(user_id, None)
+        self.configs.pop(user_id, None)
+        self._config_at.pop(user_id, None)
+
+    # --- পুরো reconnect (নতুন session); config পরিবর্তনে mark_dirty ব্যবহার করুন ---
     async def restart_client(self, user_id: int):
-        async with self._lock:
-            if user_id in self.clients:
-                try:
-                    await self.clients[user_id].stop()
-                except:
-                    pass
-                del self.clients[user_id]
-            
-            # আগের টাস্ক ক্লিয়ার করা
-            if user_id in self.monitor_tasks:
-                for t in self.monitor_tasks[user_id].values():
-                    t.cancel()
-                del self.monitor_tasks[user_id]
+        async with self._user_lock(user_id):
+            await self._detach_client(user_id)
 
         # আবার চালু করা
         await self.ensure_client(user_id)
 
     async def ensure_client(self, user_id: int) -> Optional[Client]:
-        async with self._lock:
+        async with self._user_lock(user_id):
+            if self._stop.is_set():
+                return None
+            h = self.health.get(user_id)
             if user_id in self.clients:
-                return self.clients[user_id]
+                # মৃত ক্লায়েন্ট ফেরত দেওয়া হবে না; supervisor/এখানে আবার কানেক্ট হবে
+                if h is None or h.state in ("healthy", "degraded", "connecting"):
+                    return self.clients[user_id]
+                await self._detach_client(user_id)
+            if h is not None and h.state == "backoff" and time.monotonic() < h.next_attempt:
+                return None
 
             sess = await self.db.get_session(user_id)
             if not sess:
+                self.health.pop(user_id, None)
                 return None
+            if h is not None and h.state == "revoked" and h.revoked_session == sess:
+                return None  # একই বাতিল session দিয়ে বারবার চেষ্টা নয়
+
+            h = self.health.setdefault(user_id, ClientHealth())
+            h.state = "connecting"
 
             app = Client(
                 name=f"user_{user_id}",
                 api_id=settings.API_ID,
                 api_hash=settings.API_HASH,
                 session_string=sess,
-                in_memory=True, # মেমোরিতে রান হবে ফাস্ট হওয়ার জন্য
+                in_memory=True, # মেমোরিতে রান হবে ফাস্ট হওয়ার জন্য
             )
             try:
                 await app.start()
+                if self._stop.is_set():
+                    # start() চলার মধ্যে stop() হয়ে গেছে; এই ক্লায়েন্ট আর কেউ থামাবে না
+                    await app.stop()
+                    return None
                 self.clients[user_id] = app
-                
+                self.session_strings[user_id] = sess
+
                 # মনিটরিং চালু (main 6.py লজিক)
                 await self._start_monitoring(user_id, app)
-                
+                await self._restore_pending(user_id, app)
+
                 me = await app.get_me()
+                self._mark_healthy(h)
                 await self.db.add_log(user_id, "INFO", f"Userbot connected: {me.first_name}")
                 return app
             except Exception as e:
+                if user_id in self.clients:
+                    await self._detach_client(user_id)
+                else:
+                    try:
+                        await app.stop()
+                    except Exception:
+                        pass
+                await self._mark_failed(user_id, h, e, sess)
                 await self.db.add_log(user_id, "ERROR", f"Start failed: {e}")
                 return None
 
+    # --- Reconciler: config/session পরিবর্তন জমিয়ে একসাথে প্রয়োগ ---
+    DIRTY_LEVELS = {"config": 0, "start": 1, "session": 2}
+
+    def mark_dirty(self, user_id: int, level: str = "config"):
+        """
+        config: DB থেকে config আবার লোড করে filter/টেমপ্লেট in-place আপডেট
+        start: config এর মতোই, আর ক্লায়েন্ট না চললে (যেমন deploy এর পর) session থাকলে চালু করা
+        session: পুরো reconnect (নতুন session)
+        উইন্ডোর মধ্যে একই ইউজারের একাধিক mark একটাই কাজ হয়ে যায়, বড় level টা থাকে।
+        """
+        cur = self._dirty.get(user_id)
+        if cur is None or self.DIRTY_LEVELS[level] > self.DIRTY_LEVELS[cur]:
+            self._dirty[user_id] = level
+        self.reconcile_metrics["marks"] += 1
+        self._dirty_event.set()
+
+    async def _reconcile_loop(self):
+        while not self._stop.is_set():
+            await self._dirty_event.wait()
+            # burst জমতে দেওয়া (পরপর কয়েকটা /allow একটাই reload)
+            await asyncio.sleep(settings.RECONCILE_WINDOW)
+            self._dirty_event.clear()
+            batch, self._dirty = self._dirty, {}
+            try:
+                await self._reconcile(batch)
+            except Exception as e:
+                await self.db.add_log(0, "ERROR", f"Reconcile failed: {e}")
+
+    async def _reconcile(self, batch: Dict[int, str]):
+        self.reconcile_metrics["rounds"] += 1
+        # শুধু যাদের ক্যাশ/ক্লায়েন্ট এই instance এ আছে; বাকিদের পরের get_config DB থেকেই আনবে
+        reloads = [uid for uid, lvl in batch.items()
+                   if lvl in ("config", "start") and (uid in self.configs or uid in self.clients)]
+        # ক্লায়েন্ট চলছে না: ensure_client নতুন config দিয়েই মনিটর চালু করবে (session না থাকলে কিছু করে না)
+        starts = [uid for uid, lvl in batch.items() if lvl == "start" and uid not in self.clients]
+        restarts = [uid for uid, lvl in batch.items() if lvl == "session"]
+
+        for i in range(0, len(reloads), 500):
+            chunk = reloads[i:i + 500]
+            for uid, cfg in (await self.db.get_configs(chunk)).items():
+                await self.refresh_user(uid, cfg)
+        self.reconcile_metrics["reloads"] += len(reloads)
+
+        sem = asyncio.Semaphore(settings.RECONCILE_CONCURRENCY)
+
+        # sem আগে: reconciler লাইনে সর্বোচ্চ RECONCILE_CONCURRENCY টা রাখে, /connect এর জায়গা থাকে
+        async def _connect(uid: int, restart: bool):
+            async with sem, self.admission:
+                try:
+                    if restart:
+                        await self.restart_client(uid)
+                    else:
+                        await self.ensure_client(uid)
+                except Exception as e:
+                    await self.db.add_log(uid, "ERROR", f"{'Restart' if restart else 'Start'} failed: {e}")
+
+        await asyncio.gather(*(_connect(uid, False) for uid in starts),
+                             *(_connect(uid, True) for uid in restarts))
+        self.reconcile_metrics["starts"] += len(starts)
+        self.reconcile_metrics["restarts"] += len(restarts)
+
+    # --- Stats flush ---
+    async def flush_stats(self):
+        rows = self.stats.take_pending()
+        try:
+            await self.db.add_chat_stats(rows)
+        except Exception as e:
+            self.stats.restore_pending(rows)
+            await self.db.add_log(0, "ERROR", f"Stats flush failed: {e}")
+
+    async def prune_send_ledger(self):
+        try:
+            await self.db.prune_send_ledger(now_ts() - settings.SEND_LEDGER_TTL)
+        except Exception as e:
+            await self.db.add_log(0, "ERROR", f"Send ledger prune failed: {e}")
+
+    async def _flush_stats_loop(self):
+        # stats flush এর সাথেই পুরনো send ledger row মোছা, যাতে লম্বা uptime এ টেবিল না বাড়ে
+        next_prune = time.monotonic() + settings.SEND_LEDGER_PRUNE_INTERVAL
+        while not self._stop.is_set():
+            await asyncio.sleep(settings.STATS_FLUSH_INTERVAL)
+            await self.flush_stats()
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + settings.SEND_LEDGER_PRUNE_INTERVAL
+                await self.prune_send_ledger()
+
+    async def user_stats(self, user_id: int, since: int) -> Dict[str, int]:
+        """since থেকে এক ইউজারের মোট (DB aggregate + এখনো flush না হওয়া অংশ)"""
+        totals = self.stats.unflushed(user_id)
+        for row in await self.db.get_chat_stats(since, user_id):
+            for k in totals:
+                totals[k] += row[k]
+        return totals
+
+    # --- Supervisor: health check + reconnect ---
+    def _mark_healthy(self, h: ClientHealth):
+        h.state = "healthy"
+        h.failures = 0
+        h.last_ok = now_ts()
+        h.last_error = ""
+        if h.next_probe <= time.monotonic():
+            # প্রথম প্রোব এলোমেলো সময়ে, যাতে পুরো fleet একসাথে প্রোব না করে
+            h.next_probe = time.monotonic() + random.uniform(0, settings.PROBE_INTERVAL)
+
+    async def _mark_failed(self, user_id: int, h: ClientHealth, err: Exception, sess: str = ""):
+        h.last_error = str(err) or type(err).__name__
+        if isinstance(err, Unauthorized):
+            h.state = "revoked"
+            h.revoked_session = sess or self.session_strings.get(user_id, "")
+            await self.db.add_log(user_id, "ERROR", "Session revoked, please /connect again", {"error": h.last_error})
+            return
+        h.failures += 1
+        # jitter সহ exponential backoff
+        delay = min(settings.RECONNECT_MAX_DELAY, settings.RECONNECT_BASE_DELAY * (2 ** (h.failures - 1)))
+        h.next_attempt = time.monotonic() + random.uniform(delay / 2, delay)
+        h.state = "backoff"
+
+    def note_send_failure(self, user_id: int):
+        """সেন্ড ফেল করলে পরের প্রোব দেরি না করে এখনই"""
+        h = self.health.get(user_id)
+        if h is not None and h.state in ("healthy", "degraded"):
+            h.next_probe = 0.0
+
+    async def _probe(self, user_id: int, app: Client, h: ClientHealth):
+        try:
+            if not app.is_connected:
+                raise ConnectionError("client disconnected")
+            await asyncio.wait_for(app.invoke(Ping(ping_id=random.getrandbits(63))), settings.PROBE_TIMEOUT)
+            self._mark_healthy(h)
+        except Unauthorized as e:
+            sess = self.session_strings.get(user_id, "")
+            async with self._user_lock(user_id):
+                # এর মধ্যে নতুন ক্লায়েন্ট বসে থাকলে সেটা ছোঁয়া হবে না
+                if self.clients.get(user_id) is app:
+                    await self._detach_client(user_id)
+            await self._mark_failed(user_id, h, e, sess)
+        except Exception as e:
+            h.failures += 1
+            h.last_error = str(e) or type(e).__name__
+            if h.failures < settings.PROBE_DEAD_AFTER:
+                h.state = "degraded"
+                h.next_probe = time.monotonic() + settings.PROBE_TIMEOUT
+            else:
+                h.state = "dead"
+                await self.db.add_log(user_id, "ERROR", f"Userbot connection dead: {h.last_error}")
+                async with self._user_lock(user_id):
+                    if self.clients.get(user_id) is app:
+                        await self._detach_client(user_id)
+                h.failures = 0
+                await self._mark_failed(user_id, h, e)
+
+    async def _supervise(self):
+        sem = asyncio.Semaphore(settings.PROBE_CONCURRENCY)
+
+        async def _run(coro):
+            async with sem:
+                try:
+                    await coro
+                except Exception:
+                    pass
+
+        busy: Dict[int, asyncio.Task] = {}
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for uid, h in list(self.health.items()):
+                if uid in busy and not busy[uid].done():
+                    continue
+                app = self.clients.get(uid)
+                if h.state in ("healthy", "degraded") and app is not None and now >= h.next_probe:
+                    h.next_probe = now + settings.PROBE_INTERVAL
+                    busy[uid] = asyncio.create_task(_run(self._probe(uid, app, h)))
+                elif h.state == "backoff" and now >= h.next_attempt:
+                    busy[uid] = asyncio.create_task(_run(self.ensure_client(uid)))
+            for uid in [u for u, t in busy.items() if t.done()]:
+                busy.pop(uid)
+            await asyncio.sleep(1)
+
+    def health_snapshot(self) -> List[Dict]:
+        now = time.monotonic()
+        out = []
+        for uid, h in self.health.items():
+            d = asdict(h)
+            d.pop("revoked_session")
+            d["user_id"] = uid
+            d["connected"] = uid in self.clients
+            d["next_probe"] = max(0.0, round(h.next_probe - now, 1))
+            d["next_attempt"] = max(0.0, round(h.next_attempt - now, 1))
+            out.append(d)
+        return out
+
     async def _start_monitoring(self, user_id: int, app: Client):
         """main (6).py এর লজিক অনুযায়ী গ্রুপ মনিটর"""
         cfg = await self.db.get_config(user_id)
-        
-        # লক্ষ্য করুন: এখানে allow_chats কেই target_groups হিসেবে ধরা হচ্ছে
-        target_groups = cfg.get("allow_chats", []) 
-        
-        if not target_groups:
-            return
+        await self.refresh_user(user_id, cfg)  # ক্যাশ (filter এখনো নেই)
 
+        # লক্ষ্য করুন: এখানে allow_chats কেই target_groups হিসেবে ধরা হচ্ছে
         # লিস্টের আইটেমগুলো ইন্টিজার কিনা নিশ্চিত করা
-        target_groups = [int(x) for x in target_groups]
+        target_groups = [int(x) for x in cfg.get("allow_chats", [])]
+
+        # allowlist খালি হলেও filter রেজিস্টার থাকে, পরে refresh_user এ চ্যাট যোগ হলে কাজ করবে
+        chat_filter = filters.chat(target_groups)
+        self.chat_filters[user_id] = chat_filter
 
         if user_id not in self.monitor_tasks:
             self.monitor_tasks[user_id] = {}
@@ -121,6 +543,7 @@ class UserbotManager:
             if not user: return
             if user.is_self: return # নিজের মেসেজ ইগনোর
             if user.username in self.IGNORED_BOTS: return # রোজ বট ইগনোর
+            self.stats.incr(user_id, chat_id, SEEN)
 
             # ২. টাইমার রিসেট লজিক (Debounce)
             user_tasks = self.monitor_tasks.get(user_id, {})
@@ -128,43 +551,64 @@ class UserbotManager:
             if chat_id in user_tasks:
                 if not user_tasks[chat_id].done():
                     user_tasks[chat_id].cancel()
+                    self.stats.incr(user_id, chat_id, RESETS)
             
             # ৩. নতুন ১৫ সেকেন্ডের টাস্ক
-            task = asyncio.create_task(self._wait_and_send_ad(user_id, client, chat_id))
-            self.monitor_tasks[user_id][chat_id] = task
+            self._schedule_send(user_id, client, chat_id, time.time() + settings.DEBOUNCE_SECONDS)
 
         # হ্যান্ডলার অ্যাড করা (শুধুমাত্র টার্গেট গ্রুপগুলোর জন্য)
         app.add_handler(MessageHandler(
             incoming_handler,
-            filters.chat(target_groups) & ~filters.me
+            chat_filter & ~filters.me
         ))
 
-    async def _wait_and_send_ad(self, user_id: int, app: Client, chat_id: int):
+    def _schedule_send(self, user_id: int, app: Client, chat_id: int, deadline: float):
+        self.pending_deadlines.setdefault(user_id, {})[chat_id] = deadline
+        task = asyncio.create_task(self._wait_and_send_ad(user_id, app, chat_id, deadline))
+        self.monitor_tasks.setdefault(user_id, {})[chat_id] = task
+
+    async def _restore_pending(self, user_id: int, app: Client):
+        """shutdown এ সেভ হওয়া টাইমারগুলো বাকি সময় সহ আবার শিডিউল"""
+        rows = await self.db.pop_pending_posts(user_id)
+        if not rows:
+            return
+        cfg = await self.get_config(user_id)
+        allow = {int(x) for x in cfg.get("allow_chats", [])}
+        cutoff = time.time() - settings.PENDING_MAX_AGE
+        restored = 0
+        for chat_id, deadline in rows:
+            # allowlist থেকে বাদ পড়েছে বা অনেক পুরনো হলে বাদ
+            if chat_id not in allow or deadline < cutoff:
+                continue
+            if chat_id in self.monitor_tasks.get(user_id, {}):
+                continue  # restore এর আগেই নতুন মেসেজ এসে টাইমার চালু হয়েছে
+            self._schedule_send(user_id, app, chat_id, deadline)
+            restored += 1
+        if restored:
+            await self.db.add_log(user_id, "INFO", f"Restored {restored} pending posts")
+
+    async def _wait_and_send_ad(self, user_id: int, app: Client, chat_id: int, deadline: float):
         try:
-            await asyncio.sleep(15) # ১৫ সেকেন্ড অপেক্ষা
-            await self._send_ad_message(user_id, app, chat_id)
+            await asyncio.sleep(max(0.0, deadline - time.time())) # ১৫ সেকেন্ড অপেক্ষা
+            # একই টাইমার দুবার পাঠাবে না (restart এর আগে পাঠানো শুরু হয়ে থাকলে)
+            send_key = f"{user_id}:{chat_id}:{int(deadline * 1000)}"
+            if not await self.db.claim_send(send_key, user_id, chat_id):
+                return
+            ok = await self._send_ad_message(user_id, app, chat_id)
+            await self.db.finish_send(send_key, "sent" if ok else "skipped")
         except asyncio.CancelledError:
             pass # নতুন মেসেজ আসলে ক্যানসেল হবে
         except Exception as e:
             await self.db.add_log(user_id, "ERROR", f"Timer Error: {e}")
         finally:
-            if user_id in self.monitor_tasks and chat_id in self.monitor_tasks[user_id]:
-                self.monitor_tasks[user_id].pop(chat_id, None)
-
-    async def _send_ad_message(self, user_id: int, app: Client, chat_id: int):
-        # ১. প্রিমিয়াম চেক (যদি দরকার হয়)
-        ok, _ = await self.db.is_premium_active(user_id)
-        if not ok: return
-
-        # ২. টেমপ্লেট লোড
-        cfg = await self.db.get_config(user_id)
-        templates = cfg.get("templates", [])
-        
-        if not templates: return
+            # শুধু নিজের এন্ট্রি মুছবে; ক্যানসেলের পর নতুন টাস্ক বসে থাকলে সেটা রেখে দেবে
+            user_tasks = self.monitor_tasks.get(user_id, {})
+            if user_tasks.get(chat_id) is asyncio.current_task():
+                user_tasks.pop(chat_id, None)
+                self.pending_deadlines.get(user_id, {}).pop(chat_id, None)
 
-        # ৩. র‍্যান্ডম সিলেকশন
-        selection = random.choice(templates)
-        
+    def _render_template(self, selection: Dict):
+        """টেমপ্লেট থেকে (photo_path, caption) বের করা"""
         caption_text = selection.get("text", "")
         # ডিফল্টভাবে DB তে image ফিল্ড নেই, তাই টেক্সট পার্সিং (main 6.py স্টাইল)
         photo_path = None
@@ -179,32 +623,133 @@ class UserbotManager:
                     # বাকি অংশ ক্যাপশন
                     caption_text = parts[1] if len(parts) > 1 else ""
 
-        # ৪. সেন্ডিং
-        try:
-            if photo_path:
-                if not os.path.exists(photo_path):
-                     photo_path = self.DEFAULT_IMAGE 
-                
-                await app.send_photo(chat_id, photo=photo_path, caption=caption_text)
-            else:
-                if caption_text:
+        if photo_path and not os.path.exists(photo_path):
+            photo_path = self.DEFAULT_IMAGE
+        return photo_path, caption_text
+
+    async def _deliver(self, app: Client, chat_id: int, photo_path: Optional[str], caption_text: str) -> Optional[str]:
+        """একটা চ্যাটে পাঠায়। সফল হলে None, না হলে error টেক্সট।"""
+        for attempt in range(2):
+            try:
+                if photo_path:
+                    await app.send_photo(chat_id, photo=photo_path, caption=caption_text)
+                elif caption_text:
                     await app.send_message(chat_id, caption_text)
+                else:
+                    return "empty template"
+                return None
+            except FloodWait as e:
+                # বড় FloodWait এ অপেক্ষা নয় (semaphore আটকে থাকত); ছোট হলে অপেক্ষা করে একবার আবার চেষ্টা
+                if attempt or e.value > settings.FLOODWAIT_RETRY_MAX:
+                    return f"FloodWait {e.value}s"
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                return str(e)
+        return "FloodWait"
 
-            await self.db.add_log(user_id, "INFO", f"Ads posted in {chat_id}")
+    def _pick_template(self, templates: List[Dict], idx: Optional[int]) -> Optional[Dict]:
+        if not templates:
+            return None
+        if idx is None:
+            # ৩. র‍্যান্ডম সিলেকশন
+            return random.choice(templates)
+        if 0 <= idx < len(templates):
+            return templates[idx]
+        return None
 
-        except FloodWait as e:
-            await asyncio.sleep(e.value)
-        except Exception as e:
-            await self.db.add_log(user_id, "ERROR", f"Post failed: {e}")
+    async def _send_ad_message(self, user_id: int, app: Client, chat_id: int, idx: Optional[int] = None) -> bool:
+        # ১. প্রিমিয়াম চেক (যদি দরকার হয়)
+        if not await self.is_premium(user_id): return False
+
+        # ২. টেমপ্লেট লোড
+        cfg = await self.get_config(user_id)
+        selection = self._pick_template(cfg.get("templates", []), idx)
+        if not selection: return False
 
-    # ম্যানুয়াল পোস্টিং (অপশনাল)
-    async def post_template(self, user_id: int, chat_id: int, idx: int):
+        # ৪. সেন্ডিং
+        photo_path, caption_text = self._render_template(selection)
+        err = await self._deliver(app, chat_id, photo_path, caption_text)
+        if err is None:
+            self.stats.incr(user_id, chat_id, SENDS)
+            await self.db.add_log(user_id, "INFO", f"Ads posted in {chat_id}")
+            return True
+        self.stats.incr(user_id, chat_id, FAILS)
+        await self.db.add_log(user_id, "ERROR", f"Post failed: {err}")
+        self.note_send_failure(user_id)
+        return False
+
+    # ম্যানুয়াল পোস্টিং (অপশনাল)
+    async def post_template(self, user_id: int, chat_id: int, idx: int) -> bool:
         app = await self.ensure_client(user_id)
         if app:
-            await self._send_ad_message(user_id, app, chat_id)
-            return True
+            return await self._send_ad_message(user_id, app, chat_id, idx)
         return False
-    
+
+    def _send_semaphore(self, user_id: int) -> asyncio.Semaphore:
+        sem = self._send_sems.get(user_id)
+        if sem is None:
+            sem = asyncio.Semaphore(settings.POST_CONCURRENCY)
+            self._send_sems[user_id] = sem
+        return sem
+
+    async def post_fanout(self, user_id: int, idx: int, chat_ids: Optional[List[int]] = None) -> Dict:
+        """
+        একটা টেমপ্লেট allowlist এর সব চ্যাটে (বা chat_ids সাবসেটে) একসাথে পোস্ট।
+        config/premium একবারই লোড হয়, সেন্ড চলে অ্যাকাউন্ট প্রতি POST_CONCURRENCY লিমিটে,
+        আর শেষে একটাই log row লেখা হয়।
+        """
+        started = time.monotonic()
+        out = {"ok": False, "error": None, "results": [], "sent": 0, "failed": 0, "elapsed": 0.0}
+
+        app = await self.ensure_client(user_id)
+        if not app:
+            out["error"] = "userbot not connected"
+            return out
+        if not await self.is_premium(user_id):
+            out["error"] = "premium inactive"
+            return out
+
+        cfg = await self.get_config(user_id)
+        selection = self._pick_template(cfg.get("templates", []), idx)
+        if not selection:
+            out["error"] = f"template {idx} not found"
+            return out
+
+        allow = [int(x) for x in cfg.get("allow_chats", [])]
+        if chat_ids:
+            allowed = set(allow)
+            targets = [c for c in dict.fromkeys(chat_ids) if c in allowed]
+            for c in chat_ids:
+                if c not in allowed:
+                    out["results"].append((c, "not in allowlist"))
+        else:
+            targets = allow
+        if not targets:
+            out["error"] = "no target chats"
+            return out
+
+        photo_path, caption_text = self._render_template(selection)
+        sem = self._send_semaphore(user_id)
+
+        async def _one(chat_id: int):
+            async with sem:
+                err = await self._deliver(app, chat_id, photo_path, caption_text)
+            self.stats.incr(user_id, chat_id, SENDS if err is None else FAILS)
+            return chat_id, err
+
+        out["results"].extend(await asyncio.gather(*(_one(c) for c in targets)))
+        out["sent"] = sum(1 for _, err in out["results"] if err is None)
+        out["failed"] = len(out["results"]) - out["sent"]
+        out["elapsed"] = time.monotonic() - started
+        out["ok"] = out["sent"] > 0
+
+        await self.db.add_log(user_id, "INFO", f"Fan-out post: {out['sent']}/{len(out['results'])} chats", {
+            "template_idx": idx,
+            "failed": {str(c): err for c, err in out["results"] if err is not None},
+            "elapsed": round(out["elapsed"], 3),
+        })
+        return out
+
     # শিডিউলিং (অপশনাল - যদি রাখতে চাও)
     async def schedule_post_in(self, *args):
         return "sched_disabled_in_this_version"